@@ -0,0 +1,9 @@
+{{ config(materialized="create") }}
+
+/* Matched MIDI files that could not be scored, and why. They are retried by the next --append run. */
+
+create table {{ this }} (
+    md5 varchar primary key,
+    reason varchar not null,
+    seconds real not null
+)
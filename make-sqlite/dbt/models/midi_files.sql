@@ -7,6 +7,8 @@
 create table {{ this }} (
     md5 varchar primary key,
     instruments integer not null,
+    drum_instruments integer not null,
+    tracks integer not null,
     summed_WNBD real,
     mean_WNBD_per_bar real,
     number_of_bars integer,
@@ -0,0 +1,22 @@
+{{ config(
+    materialized="create",
+    post_hook="create index idx_midi_instrument on {{ this.name }} (model, instrument_group, md5)"
+  )
+}}
+
+/* One row per MIDI file, synpy3 model and instrument group, for loads run with make_sqlite --instrument-scores. */
+
+create table {{ this }} (
+    md5 varchar not null,
+    model varchar not null,
+    instrument_group varchar not null,
+    notes integer not null,
+    summed_syncopation real,
+    mean_syncopation_per_bar real,
+    number_of_bars integer not null,
+    number_of_bars_not_measured integer not null,
+    syncopation_by_bar blob not null,
+    bars_measured blob not null,
+    primary key (md5, model, instrument_group),
+    foreign key (md5) references {{ ref("midi_files").name }}(md5)
+)
@@ -0,0 +1,10 @@
+{{ config(materialized="create") }}
+
+/* Every .mid file found under the MMD_MIDI directory when the load started. */
+
+create table {{ this }} (
+    md5 varchar primary key,
+    path varchar not null,
+    size integer not null,
+    mtime real not null
+)
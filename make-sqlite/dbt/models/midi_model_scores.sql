@@ -0,0 +1,20 @@
+{{ config(
+    materialized="create",
+    post_hook="create index idx_midi_model on {{ this.name }} (model, md5)"
+  )
+}}
+
+/* One row per MIDI file and synpy3 model scored with make_sqlite --models. */
+
+create table {{ this }} (
+    md5 varchar not null,
+    model varchar not null,
+    summed_syncopation real,
+    mean_syncopation_per_bar real,
+    number_of_bars integer not null,
+    number_of_bars_not_measured integer not null,
+    syncopation_by_bar blob not null,
+    bars_measured blob not null,
+    primary key (md5, model),
+    foreign key (md5) references {{ ref("midi_files").name }}(md5)
+)
@@ -0,0 +1,10 @@
+{{ config(materialized="create") }}
+
+/* Rows of the matches TSV that failed validation, kept as they were read. */
+
+create table {{ this }} (
+    md5 varchar,
+    sid varchar,
+    score varchar,
+    reason varchar not null
+)
\ No newline at end of file
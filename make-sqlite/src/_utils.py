@@ -1,14 +1,29 @@
 from pathlib import Path
-import json
 
 DBT_PATH: Path = Path("dbt").absolute()
 MMD_AUDIO_TEXT_MATCHES_PATH: Path = Path("dbt/data/MMD_audio_text_matches.tsv").absolute()
 MMD_MIDI_DIR_PATH: Path = Path("dbt/data/MMD_MIDI/").absolute()
 SQLITE_SAVE_PATH: Path = Path("dbt/data.sqlite3").absolute()
 TRACKS_FEATURES_PATH: Path = Path("dbt/data/tracks_features.csv")
+SCORE_CACHE_PATH: Path = Path("cache/scores.sqlite3").absolute()
+TRACK_CACHE_PATH: Path = Path("cache/tracks.sqlite3").absolute()
+TRACK_CACHE_TTL: float = 30 * 24 * 60 * 60 # seconds a cached tracks response stays fresh
+FEATURES_SNAPSHOT_PATH: Path = Path("cache/features").absolute()
+SYNPY3_PATH: Path = Path(__file__).parent.joinpath("synpy3")
+SPOTIFY_API_URL: str = "https://api.spotify.com/v1"
+SPOTIFY_AUTH_URL: str = "https://accounts.spotify.com/api/token"
+SPOTIFY_BATCH_SIZE: int = 50 # most ids the tracks endpoint accepts per request
+SPOTIFY_CONCURRENCY: int = 4 # tracks requests in flight at once
+SPOTIFY_RATE: float = 5.0 # tracks requests per second, averaged
 PROCS: int = 8
+BATCH_SIZE: int = 5000 # rows per executemany call
+COMMIT_EVERY: int = 20000 # rows (data and journal entries) per committed batch
+CHUNKSIZE: int = 16 # MIDI files in flight per worker process (handed over or waiting for the writer)
+FILE_TIMEOUT: float = 300.0 # seconds one MIDI file may take to score before it is given up on
+RECYCLE_AFTER: int = 1000 # MIDI files a worker process scores before it is replaced
+SCAN_THREADS: int = 16 # threads listing the MMD_MIDI tree for the manifest
+QUEUE_SIZE: int = 256 # finished batches/files waiting for the writer before producers block
 
-def save_progress(ids: list[str]):
-    """Save the list of Spotify ids to logs/failed_track_ids.json for a failed attempt."""
-    with open("./logs/failed_track_ids.json", "w") as file:
-        json.dump(ids, file)
\ No newline at end of file
+def midi_path(midi_dir: Path, md5: str) -> Path:
+    """Path to a MIDI file in the MMD directory layout (md5[0]/md5[1]/md5[2]/md5.mid)."""
+    return midi_dir.joinpath(md5[0], md5[1], md5[2], md5 + ".mid")
@@ -0,0 +1,56 @@
+""" Per-bar syncopation stored as binary arrays in midi_model_scores.
+
+    Each (file, model) row keeps its syncopation_by_bar as one little-endian float32
+    BLOB, plus a bit-packed mask of the bars the model could measure (unmeasured bars
+    are stored as 0). Reading goes through np.frombuffer, so the values are a view on
+    the bytes SQLite returned rather than a copy, and a corpus of ~10M bars stays one
+    row per file and model instead of one row per bar.
+"""
+import sqlite3
+from typing import Generator, Iterable, Optional
+import numpy as np
+
+from .cache import SQL_VARIABLES
+
+BAR_DTYPE = np.dtype("<f4")
+
+def encode_bars(syncopation_by_bar: list[Optional[float]]) -> tuple[bytes, bytes]:
+    """The (values, measured mask) BLOBs for one calculate_syncopation output."""
+    measured = np.array([value is not None for value in syncopation_by_bar], dtype=bool)
+    values = np.array([0.0 if value is None else value for value in syncopation_by_bar], dtype=BAR_DTYPE)
+    return values.tobytes(), np.packbits(measured).tobytes()
+
+def decode_bars(values: bytes, mask: bytes) -> np.ma.MaskedArray:
+    """ Per-bar syncopation as a masked array, masked where the bar was not measured.
+        The data is a read-only view on values."""
+    data = np.frombuffer(values, dtype=BAR_DTYPE)
+    measured = np.unpackbits(np.frombuffer(mask, dtype=np.uint8), count=len(data)).astype(bool)
+    return np.ma.MaskedArray(data, mask=~measured)
+
+def read_bar_scores(
+        db: sqlite3.Connection,
+        model: str = "WNBD",
+        md5s: Optional[Iterable[str]] = None,
+) -> Generator[tuple[str, np.ma.MaskedArray], None, None]:
+    """ Yield (md5, per-bar syncopation) for every file scored with model, or only for md5s
+        (looked up SQL_VARIABLES at a time, in no particular order). Rows are streamed, so the
+        whole corpus is never in memory at once."""
+    if md5s is None:
+        cursor = db.execute(
+            "select md5, syncopation_by_bar, bars_measured from midi_model_scores where model = ?",
+            (model,)
+        )
+        for md5, values, mask in cursor:
+            yield md5, decode_bars(values, mask)
+        return
+
+    md5s = list(md5s)
+    for pos in range(0, len(md5s), SQL_VARIABLES):
+        chunk = md5s[pos : pos + SQL_VARIABLES]
+        cursor = db.execute(
+            "select md5, syncopation_by_bar, bars_measured from midi_model_scores"
+            f" where model = ? and md5 in ({','.join('?' * len(chunk))})",
+            (model, *chunk)
+        )
+        for md5, values, mask in cursor:
+            yield md5, decode_bars(values, mask)
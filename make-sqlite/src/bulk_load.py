@@ -0,0 +1,66 @@
+""" Bulk-load mode: load into bare tables, then index and check them once.
+
+    The dbt models create each table together with a secondary index (their
+    post_hook). In bulk-load mode those indexes are dropped before the load and
+    rebuilt afterwards, so rows are not paying for index maintenance one at a time.
+    Which indexes those are is read from sqlite_master rather than listed here, and
+    their DDL is kept in the database (dropped_indexes) until they are rebuilt, so a
+    load interrupted in between still gets them back from the next build_indexes.
+    SQLite only enforces foreign keys with PRAGMA foreign_keys = on, so they are kept
+    off during the load and checked in a single foreign_key_check pass at the end.
+"""
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Generator
+
+class PhaseTimer:
+    """Wall-clock time of each phase of a run, in the order the phases ran."""
+
+    def __init__(self):
+        self.durations: dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Generator[None, None, None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self) -> str:
+        width = max(map(len, [*self.durations, "total"]))
+        lines = [f"{name:<{width}}  {seconds:10.2f}s" for name, seconds in self.durations.items()]
+        lines.append(f"{'total':<{width}}  {sum(self.durations.values()):10.2f}s")
+        return "\n".join(lines)
+
+def drop_indexes(db: sqlite3.Connection):
+    """ Drop every secondary index so the tables are bare for the load, saving their DDL in
+        dropped_indexes (next to any saved by an earlier load that was never rebuilt)."""
+    db.execute("pragma foreign_keys = off")
+    db.execute("create table if not exists dropped_indexes (name varchar primary key, sql varchar not null)")
+    # automatic indexes (primary keys, unique constraints) have no sql and stay
+    indexes = db.execute("select name, sql from sqlite_master where type = 'index' and sql is not null").fetchall()
+    db.executemany("insert or replace into dropped_indexes (name, sql) values (?, ?)", indexes)
+    for name, _ in indexes:
+        db.execute(f'drop index "{name}"')
+    db.commit()
+
+def build_indexes(db: sqlite3.Connection):
+    """(Re)create every index drop_indexes saved, in one pass over the loaded tables."""
+    if db.execute("select 1 from sqlite_master where type = 'table' and name = 'dropped_indexes'").fetchone() is None:
+        return
+    existing = {name for name, in db.execute("select name from sqlite_master where type = 'index'")}
+    for name, sql in db.execute("select name, sql from dropped_indexes").fetchall():
+        if name not in existing:
+            db.execute(sql)
+    db.execute("drop table dropped_indexes")
+    db.commit()
+
+def check_integrity(db: sqlite3.Connection) -> dict[tuple[str, str], int]:
+    """ Check every declared foreign key at once.
+        Returns the number of orphaned rows per (table, referenced table)."""
+    violations: dict[tuple[str, str], int] = {}
+    for table, _, parent, _ in db.execute("pragma foreign_key_check"):
+        violations[(table, parent)] = violations.get((table, parent), 0) + 1
+    return violations
@@ -0,0 +1,161 @@
+""" Persistent caches of syncopation scores and Spotify tracks responses.
+
+    Score entries are keyed by the MIDI md5, the model name, the model parameters, a
+    fingerprint of the synpy3 source and SCORE_FORMAT, so editing a model or changing its
+    parameters invalidates old entries without any manual cleanup. What an entry holds
+    beyond calculate_syncopation's output (the file statistics and instrument groups
+    added by models.MIDI.score and scoring) is not covered by the fingerprint, so
+    SCORE_FORMAT has to be bumped whenever that changes. Track entries are keyed by
+    Spotify id and go stale after a TTL instead, since they only change upstream.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from functools import lru_cache
+from pathlib import Path
+from types import ModuleType
+from typing import Iterable, Optional
+
+from ._utils import COMMIT_EVERY, SCORE_CACHE_PATH, SYNPY3_PATH, TRACK_CACHE_PATH, TRACK_CACHE_TTL
+
+SQL_VARIABLES: int = 500 # ids bound per select, well under SQLite's variable limit
+SCORE_FORMAT: int = 1 # version of what MIDI.score adds to a cached output; bump when that changes
+
+@lru_cache(maxsize=None)
+def synpy3_fingerprint() -> str:
+    """Hash of every synpy3 module (tests excluded) and the time signature table."""
+    digest = hashlib.sha256()
+    modules = [file for file in SYNPY3_PATH.glob("*.py") if not file.name.startswith("test_")]
+    files = sorted(modules) + [SYNPY3_PATH.joinpath("TimeSignature.pkl")]
+    for file in files:
+        digest.update(file.name.encode())
+        digest.update(file.read_bytes())
+    return digest.hexdigest()
+
+def model_name(model: ModuleType) -> str:
+    """Name of a synpy3 model module, independent of how the package was imported."""
+    return model.__name__.rsplit(".", 1)[-1]
+
+class ScoreCache:
+    """ On-disk cache of calculate_syncopation outputs, stored in a small SQLite file.
+        Only one process should write to a ScoreCache at a time."""
+
+    def __init__(self, path: Path = SCORE_CACHE_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute("""
+            create table if not exists scores (
+                key varchar primary key,
+                md5 varchar not null,
+                model varchar not null,
+                value text not null
+            )
+        """)
+        self._pending = 0
+
+    def __enter__(self) -> "ScoreCache":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def key(md5: str, model: ModuleType, parameters: Optional[dict] = None) -> str:
+        """Content address of a (file, model, parameters, synpy3 version, score format) combination."""
+        raw = json.dumps(
+            [md5, model_name(model), parameters or {}, synpy3_fingerprint(), SCORE_FORMAT],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, md5: str, model: ModuleType, parameters: Optional[dict] = None) -> Optional[dict]:
+        """Return the cached output for md5 under model/parameters, or None on a miss."""
+        row = self._db.execute(
+            "select value from scores where key = ?",
+            (self.key(md5, model, parameters),)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, md5: str, model: ModuleType, output: dict, parameters: Optional[dict] = None):
+        """Store the output for md5 under model/parameters, replacing any previous entry."""
+        self._db.execute(
+            "insert or replace into scores (key, md5, model, value) values (?, ?, ?, ?)",
+            (self.key(md5, model, parameters), md5, model_name(model), json.dumps(output))
+        )
+        self._pending += 1
+        if self._pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self._db.commit()
+        self._pending = 0
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+class TrackCache:
+    """ On-disk cache of tracks endpoint responses, one entry per Spotify id. Ids the API
+        has no track for are cached as None too, so they are not requested again either.
+        Entries older than ttl seconds are treated as misses (ttl None never expires).
+        Only one process should write to a TrackCache at a time."""
+
+    def __init__(self, path: Path = TRACK_CACHE_PATH, ttl: Optional[float] = TRACK_CACHE_TTL):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self._db = sqlite3.connect(path)
+        self._db.execute("""
+            create table if not exists tracks (
+                spotify_id varchar primary key,
+                value text not null,
+                fetched_at real not null
+            )
+        """)
+
+    def __enter__(self) -> "TrackCache":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_many(self, ids: Iterable[str]) -> dict[str, Optional[dict]]:
+        """The fresh cached response for every id that has one. Misses are left out."""
+        ids = list(ids)
+        oldest = 0.0 if self.ttl is None else time.time() - self.ttl
+        hits = {}
+        for pos in range(0, len(ids), SQL_VARIABLES):
+            chunk = ids[pos : pos + SQL_VARIABLES]
+            rows = self._db.execute(
+                f"select spotify_id, value from tracks where fetched_at >= ? and spotify_id in ({','.join('?' * len(chunk))})",
+                (oldest, *chunk)
+            )
+            hits.update((id, json.loads(value)) for id, value in rows)
+        return hits
+
+    def put_many(self, ids: list[str], track_results: list[Optional[dict]]):
+        """ Store one tracks endpoint response for ids and commit it right away, since
+            every entry cost a rate-limited request."""
+        by_id = {track["id"]: track for track in track_results if track is not None}
+        now = time.time()
+        self._db.executemany(
+            "insert or replace into tracks (spotify_id, value, fetched_at) values (?, ?, ?)",
+            [(id, json.dumps(slim_track(by_id.get(id))), now) for id in ids]
+        )
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+def slim_track(track: Optional[dict]) -> Optional[dict]:
+    """A tracks response without its available_markets lists, which are most of its size."""
+    if track is None:
+        return None
+    track = {key: value for key, value in track.items() if key != "available_markets"}
+    if isinstance(track.get("album"), dict):
+        track["album"] = {key: value for key, value in track["album"].items() if key != "available_markets"}
+    return track
@@ -0,0 +1,128 @@
+""" Indexed store of the Kaggle audio features.
+
+    Only the id and the six feature columns are read, only for the Spotify ids that
+    appear in the matches file, and the values are kept as one float32 matrix with a
+    dict from id to row. The store can be saved as a NumPy snapshot that later runs
+    memory-map instead of parsing the 1.2M-row CSV again.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Iterable, Optional
+import numpy as np
+import pandas as pd
+
+from ._utils import FEATURES_SNAPSHOT_PATH
+
+FEATURE_COLUMNS: tuple[str, ...] = (
+    "danceability",
+    "acousticness",
+    "energy",
+    "valence",
+    "speechiness",
+    "instrumentalness",
+)
+CSV_CHUNKSIZE: int = 200_000 # rows of the features CSV parsed at a time
+
+class FeatureStore:
+    """Audio features for a set of Spotify ids, one float32 row per id."""
+
+    def __init__(self, ids: np.ndarray, values: np.ndarray):
+        assert values.shape == (len(ids), len(FEATURE_COLUMNS))
+        self.ids = ids
+        self.values = values
+        self._index: dict[str, int] = {id: row for row, id in enumerate(ids.tolist())}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._index
+
+    def get(self, id: str) -> Optional[np.ndarray]:
+        """The feature row for id (in FEATURE_COLUMNS order), or None if it has no features."""
+        row = self._index.get(id)
+        return None if row is None else self.values[row]
+
+    @classmethod
+    def from_csv(cls, path: Path, sids: Optional[Iterable[str]] = None) -> "FeatureStore":
+        """ Read the features CSV, keeping only rows whose id is in sids (all rows if sids is None).
+            The CSV is read in chunks so the full table is never in memory at once."""
+        wanted = None if sids is None else set(sids)
+        ids, values = [], []
+        chunks = pd.read_csv(
+            path,
+            usecols=["id", *FEATURE_COLUMNS],
+            dtype={"id": str, **{column: np.float32 for column in FEATURE_COLUMNS}},
+            chunksize=CSV_CHUNKSIZE,
+        )
+        for chunk in chunks:
+            if wanted is not None:
+                chunk = chunk[chunk["id"].isin(wanted)]
+            chunk = chunk.drop_duplicates("id")
+            ids.append(chunk["id"].to_numpy(dtype=str))
+            values.append(chunk[list(FEATURE_COLUMNS)].to_numpy(dtype=np.float32))
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=str)
+        values = np.concatenate(values) if values else np.empty((0, len(FEATURE_COLUMNS)), dtype=np.float32)
+        # an id can repeat across chunks, keep its first row like within a chunk
+        ids, first = np.unique(ids, return_index=True)
+        return cls(ids, values[first])
+
+    def save(self, path: Path, fingerprint: str = ""):
+        """ Write the store as a snapshot directory (ids.npy, values.npy, meta.json). It is written
+            next to path and moved into place whole, so a crash midway leaves either the previous
+            snapshot or none, never ids and values that do not belong together."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=path.name + ".", dir=path.parent))
+        try:
+            np.save(staging.joinpath("ids.npy"), self.ids)
+            np.save(staging.joinpath("values.npy"), np.ascontiguousarray(self.values, dtype=np.float32))
+            staging.joinpath("meta.json").write_text(json.dumps({"fingerprint": fingerprint}))
+            if path.exists():
+                # a directory can only be renamed over an empty one, so the old snapshot moves out first
+                stale = staging.with_name(staging.name + ".old")
+                os.replace(path, stale)
+                os.replace(staging, path)
+                shutil.rmtree(stale, ignore_errors=True) # still mapped by an open store on some platforms
+            else:
+                os.replace(staging, path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+    @classmethod
+    def load(cls, path: Path) -> "FeatureStore":
+        """Open a snapshot written by save. The values are memory-mapped, not read."""
+        ids = np.load(path.joinpath("ids.npy"))
+        values = np.load(path.joinpath("values.npy"), mmap_mode="r")
+        return cls(ids, values)
+
+    @classmethod
+    def open(cls, csv_path: Path, sids: Iterable[str], snapshot_path: Optional[Path] = FEATURES_SNAPSHOT_PATH) -> "FeatureStore":
+        """ Load the snapshot at snapshot_path if it was built from the same CSV for the same
+            sids, otherwise build the store from the CSV and save a new snapshot there.
+            With snapshot_path None the CSV is always read and nothing is saved."""
+        sids = sorted(set(sids))
+        if snapshot_path is None:
+            return cls.from_csv(csv_path, sids)
+
+        fingerprint = snapshot_fingerprint(csv_path, sids)
+        meta_path = snapshot_path.joinpath("meta.json")
+        if meta_path.exists() and json.loads(meta_path.read_text()).get("fingerprint") == fingerprint:
+            return cls.load(snapshot_path)
+
+        store = cls.from_csv(csv_path, sids)
+        store.save(snapshot_path, fingerprint)
+        return store
+
+def snapshot_fingerprint(csv_path: Path, sids: list[str]) -> str:
+    """Identifies the CSV (by size and mtime) and the set of sorted sids a snapshot was built for."""
+    stat = csv_path.stat()
+    digest = hashlib.sha256(f"{csv_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    for sid in sids:
+        digest.update(sid.encode())
+        digest.update(b"\n")
+    return digest.hexdigest()
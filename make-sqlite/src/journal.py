@@ -0,0 +1,87 @@
+""" Crash-safe progress journal for make_sqlite runs.
+
+    The journal is a table in the output database itself, and its rows go through
+    the same BatchWriter as the data, so a batch of rows and the record that the
+    batch is done are committed in the same transaction. After a crash the journal
+    says exactly which md5s/sids made it to disk.
+
+    What is left to load is found with one anti-join of a temp table of wanted ids
+    against both the journal and the phase's table, so an --append run after new
+    files or matches were added costs time in proportion to what is new. The same
+    temp table carries the links and manifest rows that make_sqlite syncs on start.
+"""
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from .writer import BatchWriter
+
+PHASES = ("spotify", "midi")
+# the table and key column each phase loads
+PHASE_TABLES: dict[str, tuple[str, str]] = {
+    "spotify": ("spotify_tracks", "spotify_id"),
+    "midi": ("midi_files", "md5"),
+}
+
+@contextmanager
+def wanted_table(db: sqlite3.Connection, columns: dict[str, str], rows: Iterable[tuple]) -> Iterator[None]:
+    """ Load rows into temp.wanted, with the given column names and types plus each row's
+        position, for the length of the with block, so they can be joined in one statement."""
+    definitions = ", ".join(f"{name} {type} not null" for name, type in columns.items())
+    db.execute(f"create temp table wanted (position integer primary key, {definitions})")
+    try:
+        db.executemany(
+            f"insert into temp.wanted ({', '.join(columns)}) values ({', '.join('?' for _ in columns)})",
+            rows
+        )
+        yield
+    finally:
+        db.execute("drop table temp.wanted")
+
+class ProgressJournal:
+    """Records which Spotify ids and MIDI md5s have been loaded."""
+
+    def __init__(self, writer: BatchWriter):
+        self.writer = writer
+        writer.db.execute("""
+            create table if not exists load_journal (
+                phase varchar not null,
+                id varchar not null,
+                primary key (phase, id)
+            )
+        """)
+
+    def pending(self, phase: str, ids: Iterable[str]) -> list[str]:
+        """ The ids, in their original order, that are neither journaled as done nor already
+            in the phase's table (which covers databases loaded before the journal existed)."""
+        assert phase in PHASES
+        table, key = PHASE_TABLES[phase]
+        db = self.writer.db
+        with wanted_table(db, {"id": "varchar"}, ((id,) for id in ids)):
+            cursor = db.execute(f"""
+                select wanted.id
+                from temp.wanted as wanted
+                where not exists (select 1 from main."{table}" as loaded where loaded."{key}" = wanted.id)
+                and not exists (select 1 from load_journal as journal where journal.phase = ? and journal.id = wanted.id)
+                order by wanted.position
+            """, (phase,))
+            return [row[0] for row in cursor]
+
+    def mark(self, phase: str, ids: Iterable[str]):
+        """ Record ids as done. They become durable with the writer's next commit,
+            together with every row added to the writer before this call."""
+        assert phase in PHASES
+        self.writer.add(
+            table_name="load_journal",
+            cols=["phase", "id"],
+            vals=[(phase, id) for id in ids],
+            integrity_handler="ignore"
+        )
+
+    def commit(self):
+        self.writer.commit()
+
+    def reset(self):
+        """Forget all progress, e.g. before a fresh (non --append) run."""
+        self.writer.db.execute("delete from load_journal")
+        self.writer.commit()
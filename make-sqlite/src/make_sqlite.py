@@ -1,4 +1,3 @@
-import json
 import subprocess
 import sqlite3
 import argparse
@@ -10,19 +9,35 @@ from tqdm import tqdm
 
 from ._utils import (
     DBT_PATH,
+    FILE_TIMEOUT,
     MMD_AUDIO_TEXT_MATCHES_PATH, 
     MMD_MIDI_DIR_PATH, PROCS, 
+    FEATURES_SNAPSHOT_PATH,
+    RECYCLE_AFTER,
+    SCORE_CACHE_PATH,
+    SPOTIFY_BATCH_SIZE,
+    SPOTIFY_CONCURRENCY,
     SQLITE_SAVE_PATH, 
+    TRACK_CACHE_PATH,
+    TRACK_CACHE_TTL,
     TRACKS_FEATURES_PATH,
-    save_progress
 )
-from .models import SpotifyTrack, MIDI
-
-def insert_spotify_track(db: sqlite3.Connection, track: SpotifyTrack):
-    """Insert a Spotify Track into the db"""
-
-    insert_many(
-        db=db,
+from .bulk_load import PhaseTimer, build_indexes, check_integrity, drop_indexes
+from .features import FeatureStore
+from .journal import ProgressJournal, wanted_table
+from .manifest import Manifest
+from .metrics import METRICS_INTERVAL, Metrics, MetricsReporter
+from .models import DEFAULT_MODELS, MODELS, LinkIndex, SpotifyTrack, MIDI, shared_api
+from .pipeline import Pipeline, midi_stage, spotify_stage
+from .scoring import ScoringFailure
+from .shard import Shard, copy_schema
+from .spotify_fetch import SpotifyFetcher
+from .writer import BatchWriter, insert_sql
+
+def insert_spotify_track(writer: BatchWriter, track: SpotifyTrack):
+    """Queue a Spotify Track for insertion into the db"""
+
+    writer.add(
         table_name="spotify_tracks",
         cols=[
             "spotify_id", 
@@ -49,8 +64,7 @@ def insert_spotify_track(db: sqlite3.Connection, track: SpotifyTrack):
     )
 
     if track.has_features:
-        insert_many(
-            db,
+        writer.add(
             table_name="audio_features",
             cols=[
                 "spotify_id",
@@ -74,52 +88,49 @@ def insert_spotify_track(db: sqlite3.Connection, track: SpotifyTrack):
             ]
         )
 
-    insert_many(
-        db=db,
+    writer.add(
         table_name="midi_spotify_map",
         cols=["md5", "spotify_id", "score"],
-        vals=[(link.md5, link.sid, link.score) for link in track.links]
+        vals=track.links, # Links are already (md5, spotify_id, score) tuples
+        integrity_handler="ignore" # the file's side may have inserted them first
     )
 
-    insert_many(
-        db=db,
+    writer.add(
         table_name="artists",
         cols=["artist_id", "title"],
         vals=[(artist.artist_id, artist.title) for artist in track.artists],
         integrity_handler="ignore" # since we only care about new artists
     )
 
-    insert_many(
-        db=db,
+    writer.add(
         table_name="albums",
         cols=["album_id", "title"],
         vals=[(track.album.album_id, track.album.title)], # only one album per track
         integrity_handler="ignore"
     )
 
-    insert_many(
-        db=db,
+    writer.add(
         table_name="spotify_album_map",
         cols=["spotify_id", "album_id"],
         vals=[(track.id, track.album.album_id)],
     )
 
-    insert_many(
-        db=db,
+    writer.add(
         table_name="spotify_artist_map",
         cols=["spotify_id", "artist_id"],
         vals=[(track.id, artist.artist_id) for artist in track.artists]
     )
 
-def insert_midi_file(db: sqlite3.Connection, file: MIDI):
-    """Insert a MIDI file into the db"""
+def insert_midi_file(writer: BatchWriter, file: MIDI):
+    """Queue a MIDI file for insertion into the db"""
 
-    insert_many(
-        db=db,
+    writer.add(
         table_name="midi_files",
         cols=[
             "md5", 
             "instruments", 
+            "drum_instruments",
+            "tracks",
             "summed_WNBD", 
             "mean_WNBD_per_bar", 
             "number_of_bars", 
@@ -131,6 +142,8 @@ def insert_midi_file(db: sqlite3.Connection, file: MIDI):
             (
                 file.md5,
                 file.instruments,
+                file.drum_instruments,
+                file.tracks,
                 file.summed_WNBD,
                 file.mean_WNBD_per_bar,
                 file.number_of_bars,
@@ -141,13 +154,104 @@ def insert_midi_file(db: sqlite3.Connection, file: MIDI):
         ]
     )
 
-    insert_many(
-        db=db,
+    writer.add(
         table_name="midi_spotify_map",
         cols=["md5", "spotify_id", "score"],
-        vals=[(link.md5, link.spotify_id, link.score) for link in file.links]
+        vals=file.links,
+        integrity_handler="ignore" # the track's side may have inserted them first
+    )
+
+    writer.add(
+        table_name="midi_model_scores",
+        cols=[
+            "md5",
+            "model",
+            "summed_syncopation",
+            "mean_syncopation_per_bar",
+            "number_of_bars",
+            "number_of_bars_not_measured",
+            "syncopation_by_bar",
+            "bars_measured",
+        ],
+        vals=file.model_scores # ModelScores are already in column order
+    )
+
+    writer.add(
+        table_name="midi_instrument_scores",
+        cols=[
+            "md5",
+            "model",
+            "instrument_group",
+            "notes",
+            "summed_syncopation",
+            "mean_syncopation_per_bar",
+            "number_of_bars",
+            "number_of_bars_not_measured",
+            "syncopation_by_bar",
+            "bars_measured",
+        ],
+        vals=file.instrument_scores # empty unless scored with --instrument-scores
+    )
+
+def insert_failure(writer: BatchWriter, failure: ScoringFailure):
+    """Queue a MIDI file that could not be scored for insertion into the db"""
+    writer.add(
+        table_name="midi_failures",
+        cols=["md5", "reason", "seconds"],
+        vals=[failure] # already in column order
     )
 
+def insert_rejected_matches(writer: BatchWriter, rejected: DataFrame):
+    """Replace the contents of rejected_matches with the rows validate_matches rejected"""
+    writer.flush() # so the delete also covers rows still in the writer's buffer
+    writer.db.execute("delete from rejected_matches")
+    writer.add(
+        table_name="rejected_matches",
+        cols=["md5", "sid", "score", "reason"],
+        vals=rejected.astype(object).where(rejected.notna(), None).itertuples(index=False, name=None)
+    )
+    if len(rejected) > 0:
+        print(f"Warning: {len(rejected)} rows of the matches file failed validation, see rejected_matches.")
+
+def insert_manifest(writer: BatchWriter, manifest: Manifest, shard: Shard):
+    """ Sync midi_manifest with the files of this shard: add new files, update the ones whose
+        path, size or mtime changed, and delete the ones that are gone. Unchanged rows are left alone."""
+    db = writer.db
+    entries = (entry for md5, entry in manifest.entries.items() if shard.has_md5(md5)) # already in column order
+    with wanted_table(db, {"md5": "varchar", "path": "varchar", "size": "integer", "mtime": "real"}, entries):
+        db.execute("delete from midi_manifest where md5 not in (select md5 from temp.wanted)")
+        db.execute("""
+            insert into midi_manifest (md5, path, size, mtime)
+            select wanted.md5, wanted.path, wanted.size, wanted.mtime
+            from temp.wanted as wanted
+            where not exists (
+                select 1 from midi_manifest as manifest
+                where manifest.md5 = wanted.md5 and manifest.path = wanted.path
+                and manifest.size = wanted.size and manifest.mtime = wanted.mtime
+            )
+            on conflict (md5) do update set path = excluded.path, size = excluded.size, mtime = excluded.mtime
+        """)
+
+def insert_loaded_links(writer: BatchWriter, links: LinkIndex, shard: Shard):
+    """ Link the files that earlier runs already loaded to rows added to the matches file since.
+        Only links missing from midi_spotify_map are inserted; files that are still pending
+        insert their links when they are loaded."""
+    db = writer.db
+    shard_links = (link for md5, md5_links in links.by_md5.items() if shard.has_md5(md5) for link in md5_links)
+    with wanted_table(db, {"md5": "varchar", "spotify_id": "varchar", "score": "real"}, shard_links):
+        # or ignore: the matches file may list the same link twice
+        db.execute("""
+            insert or ignore into midi_spotify_map (md5, spotify_id, score)
+            select wanted.md5, wanted.spotify_id, wanted.score
+            from temp.wanted as wanted
+            where exists (select 1 from midi_files as loaded where loaded.md5 = wanted.md5)
+            and not exists (
+                select 1 from midi_spotify_map as map
+                where map.md5 = wanted.md5 and map.spotify_id = wanted.spotify_id
+            )
+            order by wanted.position
+        """)
+
 def insert_many(
         db: sqlite3.Connection,
         table_name: str,
@@ -156,19 +260,8 @@ def insert_many(
         integrity_handler: str = "raise",
 ):
     """Wrapper around executemany for arbitrary tables."""
-    assert integrity_handler in ("ignore", "raise", "warn")
-    col_sql = ", ".join(map(lambda x: f'"{x}"', cols))
-    qs_sql = ", ".join(["?"] * len(cols))
-
     assert all(len(i) == len(cols) for i in vals)
-
-    sql = f"""
-        insert into "{table_name}" ({col_sql})
-        values ({qs_sql})
-    """
-
-    if integrity_handler == "ignore":
-        sql += "\n on conflict do nothing"
+    sql = insert_sql(table_name, tuple(cols), integrity_handler)
 
     try:
         db.executemany(sql, vals)
@@ -178,41 +271,6 @@ def insert_many(
         else:
             raise
 
-def is_one_in_table(db: sqlite3.Connection, table: str, id: str) -> bool:
-    """Checks whether an sid/md5 is already in db. table must be either spotify_tracks or midi_files."""
-    assert table in ("spotify_tracks", "midi_files")
-    key = "spotify_id" if table == "spotify_tracks" else "md5"
-    cursor = db.cursor()
-    cursor.execute(
-        "select exists("
-            f"select 1 from {table} where {key} = ?"
-        ")",
-        (id,)
-    )
-    return cursor.fetchone()[0] == 1
-
-def are_many_in_table(db: sqlite3.Connection, ids: list[str]) -> bool:
-    """ Checks whether the batch of ID's are in the spotify_tracks table.
-        This can only be used for spotify_tracks as MIDI files aren't done
-        in batches."""
-    ids_parameterized = ",".join(["?" for _ in ids])
-    cursor = db.cursor()
-    cursor.execute(f"""
-        select count(distinct spotify_id) 
-        from spotify_tracks 
-        where spotify_id in ({ids_parameterized})
-    """, ids)
-    return cursor.fetchone()[0] == len(ids)
-    # ids_parameterized = ",".join(["?" for id in ids])
-    # cursor = db.cursor()
-    # cursor.execute(
-    #     "select exists("
-    #         f"select spotify_id from spotify_tracks where spotify_id in ({ids_parameterized})"
-    #     ")",
-    #     (ids,),
-    # )
-    # return len(cursor.fetchall()) == len(ids)
-
 def chunker(seq: Iterable, size: int) -> Generator:
     """Thx stackoverfow"""
     return (seq[pos : pos + size] for pos in range(0, len(seq), size))
@@ -246,6 +304,13 @@ def parse_args() -> argparse.Namespace:
         default=TRACKS_FEATURES_PATH
     )
 
+    parser.add_argument(
+        "--features-snapshot",
+        type=Path,
+        help="The path to the binary snapshot of the audio features, rebuilt from --features when stale.",
+        default=FEATURES_SNAPSHOT_PATH
+    )
+
     parser.add_argument(
         "--midis",
         type=Path,
@@ -263,7 +328,14 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--append",
         action="store_true",
-        help="Option to append the existing database with new tracks only."
+        help="Option to append to the existing database, loading only the files and tracks that are not in it yet."
+    )
+
+    parser.add_argument(
+        "--shard",
+        type=Shard.parse,
+        help="Process only shard i of N (as i/N) into its own database next to --out; combine the shards with merge_shards.",
+        default=Shard()
     )
 
     parser.add_argument(
@@ -275,10 +347,97 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--procs",
         type=int,
-        help="The number of processes to use for multiprocessing",
+        help="The number of processes to use for multiprocessing (with 1 and no --file-timeout or --file-memory, files are scored in this process)",
         default=PROCS
     )
 
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        choices=list(MODELS),
+        help="The synpy3 models to score every MIDI file with, in one pass per file. WNBD is always included.",
+        default=list(DEFAULT_MODELS)
+    )
+
+    parser.add_argument(
+        "--instrument-scores",
+        action="store_true",
+        help="Option to also score every model on the drums, the other instruments and each track of every MIDI file on their own, into midi_instrument_scores."
+    )
+
+    parser.add_argument(
+        "--file-timeout",
+        type=float,
+        help="The number of seconds a MIDI file may take to score before it is recorded in midi_failures instead (0 for no limit)",
+        default=FILE_TIMEOUT
+    )
+
+    parser.add_argument(
+        "--file-memory",
+        type=int,
+        help="The address space in MB each scoring process may use; a file that needs more is recorded in midi_failures instead."
+    )
+
+    parser.add_argument(
+        "--max-tasks-per-child",
+        type=int,
+        help="The number of MIDI files a scoring process handles before it is replaced (0 to keep it for the whole run)",
+        default=RECYCLE_AFTER
+    )
+
+    parser.add_argument(
+        "--spotify-concurrency",
+        type=int,
+        help="The number of Spotify tracks requests to keep in flight at once",
+        default=SPOTIFY_CONCURRENCY
+    )
+
+    parser.add_argument(
+        "--cache",
+        type=Path,
+        help="The path to the on-disk cache of syncopation scores.",
+        default=SCORE_CACHE_PATH
+    )
+
+    parser.add_argument(
+        "--track-cache",
+        type=Path,
+        help="The path to the on-disk cache of Spotify tracks responses.",
+        default=TRACK_CACHE_PATH
+    )
+
+    parser.add_argument(
+        "--track-cache-ttl",
+        type=float,
+        help="The number of days a cached Spotify tracks response is used before it is fetched again.",
+        default=TRACK_CACHE_TTL / (24 * 60 * 60)
+    )
+
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Option to fetch and score everything from scratch without reading or writing the score or track caches."
+    )
+
+    parser.add_argument(
+        "--metrics",
+        type=Path,
+        help="The path to periodically write run metrics to, as JSON for a .json path and as a Prometheus textfile otherwise."
+    )
+
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        help="The number of seconds between writes to --metrics",
+        default=METRICS_INTERVAL
+    )
+
+    parser.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="Option to load into bare tables, then build indexes and check foreign keys once at the end."
+    )
+
     args = parser.parse_args()
     return args
 
@@ -288,50 +447,126 @@ if __name__ == "__main__":
     # then, read the matches.tsv file into a df
     # then, get a list of unique md5s in the df
     args = parse_args()
+    out = args.shard.path(args.out)
 
     if args.append:
-        assert args.out.exists()
+        assert out.exists()
 
-    if not args.no_dbt and not args.append:
-        dbt("clean")
-        dbt("run")
+    timer = PhaseTimer()
+    with timer.phase("create tables"):
+        if not args.no_dbt and not args.append:
+            dbt("clean")
+            dbt("run")
 
     assert args.matches.exists(), "Must provide a valid path to the matches file."
     assert args.features.exists(), "Must provide a valid path to the audio features file."
     assert args.midis.exists(), "Must provide a valid path to the MIDI file directory."
 
-    db = sqlite3.connect(args.out, timeout=10000)
-    matches = pd.read_csv(args.matches, sep="\t")
-    audio_features = pd.read_csv(args.features)
-
-    unique_sids = Series(matches["sid"].unique())
-    if args.append:
-        with open("./logs/failed_track_ids.json", 'r') as file:
-            last_ids = json.load(file)
-            unique_sids = unique_sids.iloc[unique_sids[unique_sids == last_ids[0]].index[0]:unique_sids.size]
-    sid_chunks = list(chunker(unique_sids, min(50, len(unique_sids))))
-    midis = []
-    for sid_chunk in tqdm(sid_chunks, total=len(sid_chunks)):
-        try:
-            spotify_tracks = SpotifyTrack.from_ids(list(sid_chunk), matches, audio_features)
-            for track in spotify_tracks:
-                insert_spotify_track(db=db, track=track)
-        except KeyboardInterrupt:
-            save_progress(list(sid_chunk))
-            print("KeyboardInterrupt interrupted spotify track insertion process. Saving ids to logs/failed_track_ids.json...")
-            raise
-    
-    unique_md5s = matches["md5"].unique()
-
-    for md5 in tqdm(unique_md5s):
-        path = args.midis.joinpath(Path(md5[0] + "/" + md5[1] + "/" + md5[2] + "/" + md5 + ".mid"))
-        midi = MIDI.from_path(path)
-        insert_midi_file(db, midi)
-
-    db.commit()
+    if args.shard.is_partial and not args.append:
+        # dbt only builds the database in its profile, shards get an empty copy of its tables
+        if out.exists():
+            out.unlink()
+        copy_schema(args.out, out)
+
+    db = sqlite3.connect(out, timeout=10000)
+    if args.bulk_load:
+        with timer.phase("create tables"):
+            drop_indexes(db)
+
+    with timer.phase("read inputs"):
+        matches = pd.read_csv(args.matches, sep="\t")
+        # one pass over the matches table; both phases look their links up here
+        links = LinkIndex(matches)
+        # only the features of tracks that are actually linked
+        feature_store = FeatureStore.open(args.features, links.by_sid, snapshot_path=args.features_snapshot)
+        # find every file once, so missing ones are known before scoring instead of failing it
+        manifest = Manifest.scan(args.midis)
+
+    metrics = Metrics()
+    reporter = MetricsReporter(metrics, args.metrics, interval=args.metrics_interval)
+    with timer.phase("load"), reporter, BatchWriter(db, metrics=metrics) as writer:
+        journal = ProgressJournal(writer)
+        if not args.append:
+            journal.reset()
+            if args.shard.index == 0: # one copy across all shards
+                insert_rejected_matches(writer, links.rejected)
+        insert_manifest(writer, manifest, args.shard)
+        # every earlier failure is pending again, and is recorded again if it still fails
+        writer.db.execute("delete from midi_failures")
+
+        # only this shard's ids/files that no earlier (possibly interrupted) run has loaded
+        unique_sids = Series(journal.pending("spotify", filter(args.shard.has_sid, links.by_sid)))
+        sid_chunks = [list(chunk) for chunk in chunker(unique_sids, SPOTIFY_BATCH_SIZE)]
+        pending_md5s = journal.pending("midi", filter(args.shard.has_md5, links.by_md5))
+        insert_loaded_links(writer, links, args.shard)
+        unique_md5s, missing_md5s, unreadable_md5s = manifest.check(pending_md5s)
+        if missing_md5s:
+            print(f"Warning: {len(missing_md5s)} matched MIDI files are not in {args.midis} and will be skipped, e.g. {missing_md5s[0]}.")
+        if unreadable_md5s:
+            print(f"Warning: {len(unreadable_md5s)} matched MIDI files are empty or unreadable and will be skipped, e.g. {unreadable_md5s[0]}.")
+
+        # fetching and scoring run on their own threads while this one writes what they finish
+        fetcher = SpotifyFetcher(shared_api(), concurrency=args.spotify_concurrency, metrics=metrics)
+        pipeline = Pipeline(metrics=metrics)
+        pipeline.stage("spotify", lambda: spotify_stage(
+            fetcher,
+            sid_chunks,
+            links,
+            feature_store,
+            cache_path=None if args.no_cache else args.track_cache,
+            cache_ttl=args.track_cache_ttl * 24 * 60 * 60,
+        ))
+        pipeline.stage("midi", lambda: midi_stage(
+            [manifest.path(md5) for md5 in unique_md5s], # biggest files first
+            links,
+            procs=args.procs,
+            cache_path=None if args.no_cache else args.cache,
+            metrics=metrics,
+            models=args.models,
+            groups=args.instrument_scores,
+            timeout=args.file_timeout,
+            memory_mb=args.file_memory,
+            recycle_after=args.max_tasks_per_child,
+        ))
+
+        spotify_progress = tqdm(total=len(unique_sids), desc="spotify", position=0)
+        midi_progress = tqdm(total=len(unique_md5s), desc="midi", position=1)
+        for stage, item in pipeline.results():
+            if stage == "spotify":
+                sid_chunk, spotify_tracks = item
+                for track in spotify_tracks:
+                    insert_spotify_track(writer=writer, track=track)
+                # the whole chunk is done, including ids the API had no track for
+                journal.mark("spotify", sid_chunk)
+                spotify_progress.update(len(sid_chunk))
+            elif isinstance(item, ScoringFailure):
+                # not marked in the journal, so --append tries the file again
+                insert_failure(writer, item)
+                midi_progress.update(1)
+            else:
+                insert_midi_file(writer, item)
+                journal.mark("midi", [item.md5])
+                midi_progress.update(1)
+        spotify_progress.close()
+        midi_progress.close()
+
+    if args.bulk_load:
+        with timer.phase("build indexes"):
+            build_indexes(db)
+        with timer.phase("check integrity"):
+            violations = check_integrity(db)
+        for (table, parent), orphans in violations.items():
+            print(f"Warning: {orphans} rows in {table} reference missing rows in {parent}.")
     db.close()
 
-    if not args.no_dbt:
+    print(timer.report())
+    print(metrics.summary())
+    if metrics.counters.get("midi_files_failed"):
+        print(f"Warning: {metrics.counters['midi_files_failed']} MIDI files could not be scored, see midi_failures.")
+
+    if args.shard.is_partial:
+        print(f"Shard {args.shard.index}/{args.shard.count} written to {out}, combine the shards with merge_shards.")
+    elif not args.no_dbt:
         dbt("test")
     
     print("All good!")
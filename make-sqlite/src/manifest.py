@@ -0,0 +1,95 @@
+""" Manifest of the MMD_MIDI directory, built once before scoring starts.
+
+    The tree is walked with os.scandir on a thread pool, one task per second-level
+    directory (md5[0]/md5[1]/), since the stat calls release the GIL. Joining the
+    manifest against the matched md5s finds missing and unreadable files before any
+    worker is started, and the file sizes let the biggest files be scheduled first.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+from ._utils import SCAN_THREADS
+
+SCAN_DEPTH: int = 2 # directory levels listed up front to make the scan's work units
+
+class ManifestEntry(NamedTuple):
+    """One .mid file, in midi_manifest column order. path is relative to the MIDI directory."""
+    md5: str
+    path: str
+    size: int
+    mtime: float
+
+class Manifest:
+    """The .mid files under a MIDI directory, by md5."""
+
+    def __init__(self, midi_dir: Path, entries: Iterable[ManifestEntry]):
+        self.midi_dir = midi_dir
+        self.entries: dict[str, ManifestEntry] = {entry.md5: entry for entry in entries}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, md5: str) -> bool:
+        return md5 in self.entries
+
+    @classmethod
+    def scan(cls, midi_dir: Path, threads: int = SCAN_THREADS) -> "Manifest":
+        """Walk midi_dir on `threads` threads and record every .mid file in it."""
+        roots, entries = _list_levels(midi_dir, SCAN_DEPTH)
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            for found in pool.map(_scan_tree, roots):
+                entries += found
+        return cls(midi_dir, [entry._replace(path=os.path.relpath(entry.path, midi_dir)) for entry in entries])
+
+    def check(self, md5s: Iterable[str]) -> tuple[list[str], list[str], list[str]]:
+        """ Split md5s into (present, missing, unreadable), where unreadable files are empty
+            or cannot be opened. Present md5s come biggest file first, so the slowest files
+            start early instead of holding up the end of the run."""
+        present, missing, unreadable = [], [], []
+        for md5 in md5s:
+            entry = self.entries.get(md5)
+            if entry is None:
+                missing.append(md5)
+            elif entry.size == 0 or not os.access(self.path(md5), os.R_OK):
+                unreadable.append(md5)
+            else:
+                present.append(md5)
+        present.sort(key=lambda md5: self.entries[md5].size, reverse=True)
+        return present, missing, unreadable
+
+    def path(self, md5: str) -> Path:
+        return self.midi_dir.joinpath(self.entries[md5].path)
+
+def _list_levels(root: Path, depth: int) -> tuple[list[str], list[ManifestEntry]]:
+    """Directories `depth` levels below root, plus any .mid files found on the way down."""
+    dirs, files = [str(root)], []
+    for _ in range(depth):
+        below = []
+        for path in dirs:
+            subdirs, found = _list_dir(path)
+            below += subdirs
+            files += found
+        dirs = below
+    return dirs, files
+
+def _scan_tree(root: str) -> list[ManifestEntry]:
+    """Every .mid file under root, with absolute paths."""
+    stack, files = [root], []
+    while stack:
+        subdirs, found = _list_dir(stack.pop())
+        stack += subdirs
+        files += found
+    return files
+
+def _list_dir(path: str) -> tuple[list[str], list[ManifestEntry]]:
+    subdirs, files = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.name.endswith(".mid"):
+                stat = entry.stat()
+                files.append(ManifestEntry(entry.name[:-4], entry.path, stat.st_size, stat.st_mtime))
+    return subdirs, files
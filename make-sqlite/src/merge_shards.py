@@ -0,0 +1,108 @@
+""" Merge the databases written by make_sqlite --shard i/N into one database.
+
+    Rows are copied table by table with insert or ignore, so Spotify tracks, artists,
+    albums and links that several shards wrote collapse onto their primary keys.
+    Indexes are dropped for the copy and rebuilt once at the end, like --bulk-load.
+"""
+import argparse
+import sqlite3
+from pathlib import Path
+
+from ._utils import SQLITE_SAVE_PATH
+from .bulk_load import PhaseTimer, build_indexes, check_integrity, drop_indexes
+from .make_sqlite import dbt
+from .writer import BatchWriter
+
+# every table make_sqlite loads; load_journal is per shard and not merged
+MERGE_TABLES: tuple[str, ...] = (
+    "spotify_tracks",
+    "audio_features",
+    "artists",
+    "albums",
+    "spotify_album_map",
+    "spotify_artist_map",
+    "midi_files",
+    "midi_model_scores",
+    "midi_instrument_scores",
+    "midi_spotify_map",
+    "midi_manifest",
+    "midi_failures",
+    "rejected_matches",
+)
+
+def merge_shard(db: sqlite3.Connection, shard_path: Path) -> dict[str, int]:
+    """Copy every row of the shard database at shard_path into db. Returns the new rows per table."""
+    db.execute("attach database ? as shard", (str(shard_path),))
+    try:
+        added = {}
+        for table in MERGE_TABLES:
+            cols = ", ".join(f'"{name}"' for _, name, *_ in db.execute(f'pragma main.table_info("{table}")'))
+            cursor = db.execute(f'insert or ignore into main."{table}" ({cols}) select {cols} from shard."{table}"')
+            added[table] = cursor.rowcount
+        db.commit()
+    finally:
+        db.execute("detach database shard")
+    return added
+
+def parse_args() -> argparse.Namespace:
+    """Parser for command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "shards",
+        type=Path,
+        nargs="+",
+        help="The shard databases to merge, e.g. dbt/data.shard-*-of-4.sqlite3"
+    )
+
+    parser.add_argument(
+        "--no-dbt",
+        action="store_true",
+        help="Option to skip dbt steps (assuming run separately)"
+    )
+
+    parser.add_argument(
+        "--out",
+        type=Path,
+        help="The path to save the merged SQLite database to.",
+        default=SQLITE_SAVE_PATH
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    for path in args.shards:
+        assert path.exists(), f"Shard database {path} does not exist."
+        assert path.resolve() != args.out.resolve(), "Cannot merge a shard into itself."
+
+    timer = PhaseTimer()
+    with timer.phase("create tables"):
+        if not args.no_dbt:
+            dbt("clean")
+            dbt("run")
+
+    db = sqlite3.connect(args.out, timeout=10000)
+    with timer.phase("create tables"):
+        drop_indexes(db)
+
+    with timer.phase("merge"), BatchWriter(db):
+        for path in args.shards:
+            added = merge_shard(db, path)
+            print(f"{path.name}: " + ", ".join(f"{rows} {table}" for table, rows in added.items()))
+
+    with timer.phase("build indexes"):
+        build_indexes(db)
+    with timer.phase("check integrity"):
+        violations = check_integrity(db)
+    for (table, parent), orphans in violations.items():
+        print(f"Warning: {orphans} rows in {table} reference missing rows in {parent}.")
+    db.close()
+
+    print(timer.report())
+
+    if not args.no_dbt:
+        dbt("test")
+
+    print("All good!")
@@ -0,0 +1,195 @@
+""" Run metrics: counters, latency histograms and gauges for each stage of a load.
+
+    Stages record into one Metrics object. Worker processes cannot, so they time their
+    steps into a plain dict that travels back with the result and is observed in the
+    parent. A MetricsReporter writes a snapshot to a JSON or Prometheus textfile every
+    few seconds, and Metrics.summary() gives the end-of-run table.
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Generator, Optional, Union
+
+# upper bounds (seconds) of the latency buckets, the last one catches everything
+BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, math.inf)
+METRICS_INTERVAL: float = 10.0 # seconds between snapshots written by a MetricsReporter
+PROMETHEUS_PREFIX: str = "make_sqlite"
+
+class Histogram:
+    """Count, sum, max and bucket counts of one stage's latencies."""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile (the max for the last bucket)."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            # cumulative, like Prometheus
+            "buckets": {str(bound): sum(self.buckets[:i + 1]) for i, bound in enumerate(BUCKETS)},
+        }
+
+class Metrics:
+    """ Thread-safe registry of counters (with rates over the run), latency histograms
+        and gauges. A gauge is a value or a callable read whenever a snapshot is taken."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters: dict[str, float] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.gauges: dict[str, Union[float, Callable[[], float]]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self.histograms.setdefault(stage, Histogram()).observe(seconds)
+
+    def observe_all(self, timings: dict[str, float]):
+        """Observe every stage of a dict filled by timed(), e.g. by a worker process."""
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+
+    def gauge(self, name: str, value: Union[float, Callable[[], float]]):
+        with self._lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def time(self, stage: str) -> Generator[None, None, None]:
+        """Observe how long the block takes under stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            return {
+                "elapsed_seconds": elapsed,
+                "counters": dict(self.counters),
+                "rates": {name: value / elapsed for name, value in self.counters.items()},
+                "gauges": {name: value() if callable(value) else value for name, value in self.gauges.items()},
+                "histograms": {stage: histogram.to_dict() for stage, histogram in self.histograms.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """The snapshot in the Prometheus text exposition format (for node_exporter's textfile collector)."""
+        snapshot = self.snapshot()
+        lines = [f"# TYPE {PROMETHEUS_PREFIX}_elapsed_seconds gauge",
+                 f"{PROMETHEUS_PREFIX}_elapsed_seconds {snapshot['elapsed_seconds']}"]
+        for name, value in snapshot["counters"].items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name}_total {value}")
+        for name, value in snapshot["gauges"].items():
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name} {value}")
+        if snapshot["histograms"]:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds histogram")
+        for stage, histogram in snapshot["histograms"].items():
+            for bound, count in histogram["buckets"].items():
+                le = "+Inf" if bound == "inf" else bound
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {count}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path):
+        """ Write a snapshot to path, as JSON for a .json path and as a Prometheus textfile otherwise.
+            The file is replaced atomically so readers never see a partial snapshot."""
+        if path.suffix == ".json":
+            text = json.dumps(self.snapshot(), indent=2)
+        else:
+            text = self.to_prometheus()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(path.name + ".tmp")
+        partial.write_text(text)
+        os.replace(partial, path)
+
+    def summary(self) -> str:
+        """End-of-run table: latency per stage, then counters with their rates per second."""
+        snapshot = self.snapshot()
+        lines = []
+        if snapshot["histograms"]:
+            width = max(map(len, snapshot["histograms"]))
+            lines.append(f"{'stage':<{width}}  {'count':>8}  {'total':>10}  {'mean':>9}  {'p50':>9}  {'p99':>9}  {'max':>9}")
+            for stage, h in snapshot["histograms"].items():
+                lines.append(
+                    f"{stage:<{width}}  {h['count']:>8}  {h['sum']:>9.2f}s  {h['mean']:>8.4f}s"
+                    f"  {h['p50']:>8.4f}s  {h['p99']:>8.4f}s  {h['max']:>8.4f}s"
+                )
+        if snapshot["counters"]:
+            width = max(map(len, snapshot["counters"]))
+            for name, value in snapshot["counters"].items():
+                lines.append(f"{name:<{width}}  {value:>12g}  {snapshot['rates'][name]:>10.1f}/s")
+        return "\n".join(lines)
+
+class MetricsReporter:
+    """ Writes metrics to path every interval seconds on a background thread, and once
+        more on exit. Use as a context manager around the run; with path None it does nothing."""
+
+    def __init__(self, metrics: Metrics, path: Optional[Path], interval: float = METRICS_INTERVAL):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+
+    def __enter__(self) -> "MetricsReporter":
+        if self.path is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.path is not None:
+            self._stop.set()
+            self._thread.join()
+            self.metrics.write(self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.metrics.write(self.path)
+
+@contextmanager
+def timed(timings: Optional[dict[str, float]], stage: str) -> Generator[None, None, None]:
+    """Add how long the block takes to timings[stage]. Does nothing if timings is None."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
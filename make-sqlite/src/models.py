@@ -1,63 +1,165 @@
 import json
 import time
-from typing import Optional, Union
+from types import ModuleType
+from typing import Iterable, NamedTuple, Optional, Union
 import requests
 import os
-from pydantic import BaseModel, PrivateAttr, validator
-from pandas import DataFrame
+from pydantic import BaseModel, PrivateAttr
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
 from pathlib import Path
 from base64 import b64encode
 from dataclasses import dataclass
-from miditoolkit import MidiFile
-import re
+from functools import lru_cache
+from threading import Lock
 import time
 
-from synpy3 import WNBD
-from synpy3.syncopation import calculate_syncopation
-from._utils import save_progress
-
-
-class Link(BaseModel):
+from .synpy3 import KTH, LHL, PRS, SG, TMC, TOB, WNBD, readmidi
+from .synpy3.smf import SMF, read_smf
+from .synpy3.syncopation import calculate_syncopation, midi_statistics
+from .cache import TrackCache, model_name
+from ._utils import SPOTIFY_API_URL, SPOTIFY_AUTH_URL, SPOTIFY_CONCURRENCY
+from .bar_scores import encode_bars
+from .features import FEATURE_COLUMNS, FeatureStore
+from .metrics import timed
+
+
+# every synpy3 model, by name; midi_files always holds WNBD, so it is always scored
+MODELS: dict[str, ModuleType] = {model_name(model): model for model in (WNBD, KTH, LHL, PRS, SG, TMC, TOB)}
+DEFAULT_MODELS: tuple[str, ...] = ("WNBD",)
+
+# the same rules the per-row Link validators used to enforce, applied to whole columns
+MD5_PATTERN = r"[a-fA-F0-9]{32}" # hexadecimal
+SID_PATTERN = r"[0-9A-Za-z]{22}" # base62
+
+def validate_matches(matches: DataFrame) -> tuple[DataFrame, DataFrame]:
+    """ Validate the md5, sid and score columns of the matches table in bulk.
+        Returns (valid, rejected): valid has the md5, sid and score columns of the good
+        rows; rejected has the bad rows as strings plus the reason for each rejection."""
+    md5 = matches["md5"].astype("string")
+    sid = matches["sid"].astype("string")
+    score = pd.to_numeric(matches["score"], errors="coerce")
+
+    # first failing check wins
+    checks = [
+        ("invalid md5", ~md5.str.fullmatch(MD5_PATTERN).fillna(False).astype(bool)),
+        ("invalid sid", ~sid.str.fullmatch(SID_PATTERN).fillna(False).astype(bool)),
+        ("invalid score", ~((score > 0) & (score <= 1))),
+    ]
+    reason = Series(pd.NA, index=matches.index, dtype="string")
+    for name, failed in checks:
+        reason = reason.mask(reason.isna() & failed, name)
+
+    ok = reason.isna()
+    valid = DataFrame({"md5": md5[ok], "sid": sid[ok], "score": score[ok]})
+    rejected = DataFrame({
+        "md5": md5[~ok],
+        "sid": sid[~ok],
+        "score": matches["score"][~ok].astype("string"),
+        "reason": reason[~ok],
+    })
+    return valid, rejected
+
+
+class Link(NamedTuple):
+    """ A link between a MIDI file and a Spotify track. Field order matches the
+        midi_spotify_map columns, so Links can go straight into executemany."""
+    md5: str
     sid: str
     score: float # represents confidence of the link
-    md5: str
 
-    def from_df(df: DataFrame) -> list["Link"]:
-        """Create a list of Links from a dataframe"""
-        return [
-            Link(
-                sid=row["sid"],
-                score=row["score"],
-                md5=row["md5"]
-            ) for idx, row in df.iterrows()
-        ]
-    
-    @validator("score", "md5", "sid", always=True)
-    def check_has_values(cls, v):
-        assert v
-        return v
-
-    @validator("score", always=True)
-    def check_score(cls, v):
-        assert v >= 0 and v <= 1
-        return v
-    
-    @validator("md5", always=True)
-    def check_md5(cls, v):
-        assert len(v) == 32
-        assert re.match(r'^[a-fA-F0-9]+$', v) # hexadecimal check
-        return v
-    
-    @validator("sid", always=True)
-    def check_sid(cls, v):
-        assert len(v) == 22
-        assert re.match(r'^[0-9A-Za-z]+$', v) # base62 check
-        return v
+    @classmethod
+    def from_df(cls, df: DataFrame) -> list["Link"]:
+        """Create a list of Links from the valid rows of a dataframe (see validate_matches)"""
+        valid, _ = validate_matches(df)
+        return cls.from_valid(valid)
+
+    @classmethod
+    def from_valid(cls, valid: DataFrame) -> list["Link"]:
+        """Create a list of Links from already-validated md5, sid and score columns"""
+        return list(map(cls._make, zip(valid["md5"].tolist(), valid["sid"].tolist(), valid["score"].tolist())))
     
 
+class LinkIndex:
+    """ Links from the matches table, grouped by md5 and by sid. Built once per run
+        so each lookup is a dict access instead of a scan over the whole table.
+        Rows that fail validate_matches are kept aside in `rejected`."""
+
+    def __init__(self, matches: DataFrame):
+        self.by_md5: dict[str, list[Link]] = {}
+        self.by_sid: dict[str, list[Link]] = {}
+        valid, self.rejected = validate_matches(matches)
+        for link in Link.from_valid(valid):
+            self.by_md5.setdefault(link.md5, []).append(link)
+            self.by_sid.setdefault(link.sid, []).append(link)
+
+    def for_md5(self, md5: str) -> list[Link]:
+        return self.by_md5.get(md5, [])
+
+    def for_sid(self, sid: str) -> list[Link]:
+        return self.by_sid.get(sid, [])
+
+
+class ModelScore(NamedTuple):
+    """ One model's syncopation of one MIDI file. Field order matches the
+        midi_model_scores columns, so ModelScores can go straight into executemany."""
+    md5: str
+    model: str
+    summed_syncopation: Optional[float]
+    mean_syncopation_per_bar: Optional[float]
+    number_of_bars: int
+    number_of_bars_not_measured: int
+    syncopation_by_bar: bytes # float32 BLOB, see bar_scores
+    bars_measured: bytes # bit-packed mask
+
+    @classmethod
+    def from_output(cls, md5: str, name: str, output: dict) -> "ModelScore":
+        """Create a ModelScore from a calculate_syncopation output dict"""
+        return cls(
+            md5,
+            name,
+            output["summed_syncopation"],
+            output["mean_syncopation_per_bar"],
+            output["number_of_bars"],
+            output["number_of_bars_not_measured"],
+            *encode_bars(output["syncopation_by_bar"]),
+        )
+
+class InstrumentScore(NamedTuple):
+    """ One model's syncopation of one group of instruments of a MIDI file. Field order matches
+        the midi_instrument_scores columns, so InstrumentScores can go straight into executemany."""
+    md5: str
+    model: str
+    instrument_group: str # all, drums, non_drums or track_<n>, see SMF.instrument_groups
+    notes: int
+    summed_syncopation: Optional[float]
+    mean_syncopation_per_bar: Optional[float]
+    number_of_bars: int
+    number_of_bars_not_measured: int
+    syncopation_by_bar: bytes # float32 BLOB, see bar_scores
+    bars_measured: bytes # bit-packed mask
+
+    @classmethod
+    def from_output(cls, md5: str, name: str, group: str, output: dict) -> "InstrumentScore":
+        """Create an InstrumentScore from the calculate_syncopation output dict of one group"""
+        return cls(
+            md5,
+            name,
+            group,
+            output["notes"],
+            output["summed_syncopation"],
+            output["mean_syncopation_per_bar"],
+            output["number_of_bars"],
+            output["number_of_bars_not_measured"],
+            *encode_bars(output["syncopation_by_bar"]),
+        )
+
 class MIDI(BaseModel):
     md5: str
     instruments: int
+    drum_instruments: int
+    tracks: int # tracks with notes
     links: list[Link] # note that one md5 can be linked to multiple spotify tracks
     summed_WNBD: float
     mean_WNBD_per_bar: float
@@ -65,91 +167,172 @@ class MIDI(BaseModel):
     number_of_bars_not_measured: int
     bars_with_valid_output: int
     bars_without_valid_output: int
+    model_scores: list[ModelScore] # one per scored model, WNBD included
+    instrument_scores: list[InstrumentScore] = [] # one per scored model and instrument group, if scored by group
 
-    def from_path(path: Path, df: DataFrame) -> "MIDI":
+    def from_path(path: Path, links: LinkIndex, models: Iterable[str] = DEFAULT_MODELS, groups: bool = False) -> "MIDI":
         """Create a MIDI object from a path to a .mid file."""
-        assert path[-4] == ".mid"
-        md5 = path[:-4]
-        links = Link.from_df(df[df["md5"] == md5])
-        wnbd = calculate_syncopation(
-            model=WNBD,
-            source=path
-        )
+        assert path.suffix == ".mid"
+        md5 = path.stem
+        return MIDI.from_scores(md5, MIDI.score(path, models, groups=groups), links.for_md5(md5))
+
+    @classmethod
+    def score(
+            cls,
+            source: Union[Path, SMF],
+            models: Iterable[str] = DEFAULT_MODELS,
+            timings: Optional[dict[str, float]] = None,
+            groups: bool = False,
+    ) -> dict[str, dict]:
+        """ Run each of the named models over a .mid file, or over one read_smf already parsed,
+            parsing it and splitting it into bars only once. Returns the calculate_syncopation
+            output dict of every model by name, each with the midi_statistics of the file
+            (instruments, drum_instruments, tracks and notes). If timings is given, the seconds
+            spent in parse, segment and each model's score (score_<model>) are added to it.
+
+            With groups, each model also scores every SMF.instrument_groups group of the file on
+            its own. The bars are laid out once and shared by the groups, and the outputs go in
+            output["groups"] by group name, each with the group's number of notes.
+
+            These outputs are what the score cache stores: bump cache.SCORE_FORMAT whenever
+            what is added to them here changes."""
+        if isinstance(source, SMF):
+            midi_file = source
+        else:
+            with timed(timings, "parse"):
+                midi_file = read_smf(source)
+        with timed(timings, "segment"):
+            barlist = readmidi.get_bars_from_midi(midi_file)
+            if groups:
+                instrument_groups = midi_file.instrument_groups()
+                # "all" is the whole file, which barlist already is
+                group_bars = readmidi.get_bars_by_group(midi_file, {
+                    group: instruments for group, instruments in instrument_groups.items() if group != "all"
+                })
+                group_notes = {group: int(np.isin(midi_file.notes.instrument, instruments).sum()) for group, instruments in instrument_groups.items()}
+        statistics = midi_statistics(midi_file)
+        outputs = {}
+        for name in models:
+            with timed(timings, f"score_{name}"):
+                output = calculate_syncopation(
+                    model=MODELS[name],
+                    source=barlist
+                )
+                if groups:
+                    group_outputs = {}
+                    for group in instrument_groups:
+                        group_output = dict(output) if group == "all" else calculate_syncopation(model=MODELS[name], source=group_bars[group])
+                        group_output["notes"] = group_notes[group]
+                        group_outputs[group] = group_output
+                    output["groups"] = group_outputs
+            if not isinstance(source, SMF):
+                output["source"] = str(source)
+            output.update(statistics)
+            outputs[name] = output
+        return outputs
+
+    @classmethod
+    def from_scores(cls, md5: str, scores: dict[str, dict], links: list[Link]) -> "MIDI":
+        """Create a MIDI object from the outputs of MIDI.score by model name (fresh or cached). They must include WNBD."""
+        wnbd = scores["WNBD"]
         return MIDI(
             md5=md5,
-            instruments=MidiFile(path).num_instruments,
+            instruments=wnbd["instruments"],
+            drum_instruments=wnbd["drum_instruments"],
+            tracks=wnbd["tracks"],
             links=links,
-            summed_WNBD=wnbd["summed_WNBD"],
-            mean_WNBD_per_bar=wnbd["mean_WNBD_per_bar"],
+            summed_WNBD=wnbd["summed_syncopation"],
+            mean_WNBD_per_bar=wnbd["mean_syncopation_per_bar"],
             number_of_bars=wnbd["number_of_bars"],
             number_of_bars_not_measured=wnbd["number_of_bars_not_measured"],
-            bars_with_valid_output=wnbd["bars_with_valid_output"],
-            bars_without_valid_output=wnbd["bars_without_valid_output"]
+            bars_with_valid_output=len(wnbd["bars_with_valid_output"]),
+            bars_without_valid_output=len(wnbd["bars_without_valid_output"]),
+            model_scores=[ModelScore.from_output(md5, name, output) for name, output in scores.items()],
+            instrument_scores=[
+                InstrumentScore.from_output(md5, name, group, group_output)
+                for name, output in scores.items() for group, group_output in output.get("groups", {}).items()
+            ],
         )
     
+TOKEN_REFRESH_MARGIN: float = 60.0 # seconds before expires_in at which a token is renewed
+
+def make_session() -> requests.Session:
+    """A keep-alive session with room in its pool for every concurrent tracks request."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, 2 * SPOTIFY_CONCURRENCY))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@lru_cache(maxsize=None)
+def shared_api() -> "SpotifyAPI":
+    """The one SpotifyAPI client of this process, so its token and connections are reused."""
+    return SpotifyAPI()
+
 class SpotifyAPI(BaseModel):
-    _client_id: str = PrivateAttr(default=os.environ["SPOTIFY_CLIENT_ID"])
-    _client_secret: str = PrivateAttr(default=os.environ["SPOTIFY_CLIENT_SECRET"])
+    api_url: str = SPOTIFY_API_URL
+    auth_url: str = SPOTIFY_AUTH_URL
+    # read when the client is created rather than when this module is imported
+    _client_id: str = PrivateAttr(default_factory=lambda: os.environ["SPOTIFY_CLIENT_ID"])
+    _client_secret: str = PrivateAttr(default_factory=lambda: os.environ["SPOTIFY_CLIENT_SECRET"])
     _api_token: str = PrivateAttr(default="")
+    _token_expires_at: float = PrivateAttr(default=0.0) # time.monotonic() deadline for _api_token
+    _token_lock: Lock = PrivateAttr(default_factory=Lock)
+    _session: requests.Session = PrivateAttr(default_factory=make_session)
+
+    @property
+    def session(self) -> requests.Session:
+        """The keep-alive session every request of this client goes through."""
+        return self._session
+
+    def token(self) -> str:
+        """ The current access token. A new one is requested when there is none yet or when
+            the current one is within TOKEN_REFRESH_MARGIN seconds of expiring."""
+        with self._token_lock:
+            if self._api_token == "" or time.monotonic() >= self._token_expires_at:
+                self._send_auth_request()
+            return self._api_token
 
     def get_tracks(self, ids: list[str], max_retries = 5) -> list[dict]:
         """ Make a GET request to the Spotify API for a list of tracks and return
-            the JSON-formatted response."""
-        try:
-            assert len(ids) <= 50, "Must request less than 50 tracks at a time."
+            the JSON-formatted response. If it fails, rerunning with --append retries the ids."""
+        assert len(ids) <= 50, "Must request less than 50 tracks at a time."
 
-            if self._api_token == "":
-                try:
-                    self._send_auth_request()
-                except e:
-                    save_progress(ids)
-                    raise e
+        ids_comma_separated = ",".join(ids)
+        
+        endpoint = self.api_url + "/tracks?ids=" + ids_comma_separated
 
-            ids_comma_separated = ",".join(ids)
-            
-            endpoint = "https://api.spotify.com/v1/tracks?ids=" + ids_comma_separated
-            header = {
-                "Authorization": "Bearer " + self._api_token
-            }
-
-            for i in range(max_retries):
-                try:
-                    response = requests.get(url=endpoint, headers=header)
-                    response.raise_for_status()
-                    return response.json()["tracks"]
-                except requests.exceptions.HTTPError as e:
-                    if e.response.status_code == 429:
-                        wait_time = int(e.response.headers["retry-after"])
-                        print(f"\nRate limit exceeded. Waiting {wait_time} seconds then retrying...")
-                        time.sleep(wait_time)
-                    elif e.response.status_code == 503:
-                        print(f"\nTracks request failed with code {e.response.status_code}. Waiting then retrying...\n")
-                        time.sleep(5.0)
-                    elif e.response.status_code == 502:
-                        print(f"\nRequest failed with code 502 (bad gateway). Refreshing auth token and retrying...\n")
-                        try:
-                            self._send_auth_request()
-                        except e:
-                            save_progress(ids)
-                            raise e
-                    else:
-                        print(f"\nAn error occured while trying to request tracks: {e}\n")
-                        save_progress(ids)
-                        raise e
-                except requests.exceptions.ConnectionError as e:
-                    print(f"\nA connection error occured while trying to request tracks, waiting 10 seconds then retrying: {e}\n")
-                    time.sleep(10.0)
-                except requests.exceptions.RequestException as e:
-                    print(f"\nAn error occured while trying to request tracks, waiting 5 seconds then retrying: {e}\n")
+        for i in range(max_retries):
+            try:
+                header = {
+                    "Authorization": "Bearer " + self.token()
+                }
+                response = self._session.get(url=endpoint, headers=header)
+                response.raise_for_status()
+                return response.json()["tracks"]
+            except requests.exceptions.HTTPError as e:
+                if e.response.status_code == 429:
+                    wait_time = int(e.response.headers["retry-after"])
+                    print(f"\nRate limit exceeded. Waiting {wait_time} seconds then retrying...")
+                    time.sleep(wait_time)
+                elif e.response.status_code == 503:
+                    print(f"\nTracks request failed with code {e.response.status_code}. Waiting then retrying...\n")
                     time.sleep(5.0)
-            else:
-                save_progress(ids)
-                print("\nMax retries exceeded for tracks request. Failed ids saved to logs/failed_track_ids.json.\n")
-                raise RuntimeError
-        except KeyboardInterrupt:
-            print("Process intererupted by user. Saving progress to logs/failed_tracks.json...")
-            save_progress(ids)
-            raise
+                elif e.response.status_code == 502:
+                    print(f"\nRequest failed with code 502 (bad gateway). Refreshing auth token and retrying...\n")
+                    self._send_auth_request()
+                else:
+                    print(f"\nAn error occured while trying to request tracks: {e}\n")
+                    raise e
+            except requests.exceptions.ConnectionError as e:
+                print(f"\nA connection error occured while trying to request tracks, waiting 10 seconds then retrying: {e}\n")
+                time.sleep(10.0)
+            except requests.exceptions.RequestException as e:
+                print(f"\nAn error occured while trying to request tracks, waiting 5 seconds then retrying: {e}\n")
+                time.sleep(5.0)
+        else:
+            print("\nMax retries exceeded for tracks request. Rerun with --append to retry these ids.\n")
+            raise RuntimeError
     
     """ Spotify deprecated their audio-features endpoint :(
         I will keep this function here on the off-chance that
@@ -194,7 +377,7 @@ class SpotifyAPI(BaseModel):
         auth_string = f"{self._client_id}:{self._client_secret}"
         auth_encoded = b64encode(auth_string.encode("ascii")).decode("ascii")
 
-        endpoint = "https://accounts.spotify.com/api/token"
+        endpoint = self.auth_url
         headers = {
             "Authorization": "Basic " + str(auth_encoded),
             "Content-Type": "application/x-www-form-urlencoded"
@@ -203,9 +386,12 @@ class SpotifyAPI(BaseModel):
 
         for i in range(max_retries):
             try:
-                response = requests.post(url=endpoint, headers=headers, data=body)
+                response = self._session.post(url=endpoint, headers=headers, data=body)
                 response.raise_for_status()
                 self._api_token = response.json()["access_token"]
+                # refresh a little early rather than waiting for a request to fail
+                expires_in = response.json().get("expires_in", 3600)
+                self._token_expires_at = time.monotonic() + expires_in - TOKEN_REFRESH_MARGIN
                 return response.json()["access_token"]
             except requests.exceptions.HTTPError as e:
                 if e.response.status_code == 429:
@@ -254,21 +440,12 @@ class Features(BaseModel):
     instrumentalness: float
 
     @classmethod
-    def from_df(cls, id: str, audio_features: DataFrame) -> "Features":
-        """ Creates a Features object from the Kaggle CSV of audio features as a dataframe"""
-        if id in audio_features["id"]:
-            row = audio_features[audio_features["id"] == id]
-            return Features(
-                id=id,
-                danceability=row["danceability"],
-                acousticness=row["acousticness"],
-                energy=row["energy"],
-                valence=row["valence"],
-                speechiness=row["speechiness"],
-                instrumentalness=row["instrumentalness"]
-            )
-        else:
+    def from_store(cls, id: str, store: FeatureStore) -> Optional["Features"]:
+        """ Creates a Features object from the store of Kaggle audio features, or None if the id has no features"""
+        row = store.get(id)
+        if row is None:
             return None
+        return Features(id=id, **dict(zip(FEATURE_COLUMNS, row.tolist())))
 
 class SpotifyTrack(BaseModel):
     id: str
@@ -283,28 +460,41 @@ class SpotifyTrack(BaseModel):
     features: Optional[Features]
 
     @classmethod
-    def from_ids(cls, ids: list[str], matches: DataFrame, audio_features: DataFrame) -> list["SpotifyTrack"]:
+    def from_ids(cls, ids: list[str], links: LinkIndex, feature_store: FeatureStore, cache: Optional[TrackCache] = None) -> list["SpotifyTrack"]:
         """ Make an API call to the Spotify API for the given Spotify ID and make a SpotifyTrack object out of what the API returns.
-            df is a DataFrame that represents the matches found in the TSV file."""
+            links is the LinkIndex built from the matches found in the TSV file. With a cache, only ids
+            it has no fresh response for are requested, so a warm cache works without the network."""
+        if cache is None:
+            return cls.from_api(ids, shared_api().get_tracks(ids), links, feature_store)
+
+        cached = cache.get_many(ids)
+        misses = [id for id in ids if id not in cached]
+        track_results = list(cached.values())
+        if misses:
+            fetched = shared_api().get_tracks(misses)
+            cache.put_many(misses, fetched)
+            track_results += fetched
+        return cls.from_api(ids, track_results, links, feature_store)
 
-        api = SpotifyAPI()
-        track_results = api.get_tracks(ids)
-
-        features_results = [Features.from_df(id=id, audio_features=audio_features) for id in ids]
+    @classmethod
+    def from_api(cls, ids: list[str], track_results: list[Optional[dict]], links: LinkIndex, feature_store: FeatureStore) -> list["SpotifyTrack"]:
+        """ Make SpotifyTrack objects out of a tracks endpoint response for ids.
+            Ids the API has no track for (null entries) are skipped."""
+        features_results = [Features.from_store(id=id, store=feature_store) for id in ids]
 
         # keep this in case Spotify un-deprecates the audio-features endpoint
         # features_results = api.get_features(ids)
         # assert len(track_results) == len(feature_results)
 
-        id_to_track = {track["id"]: track for track in track_results}
+        id_to_track = {track["id"]: track for track in track_results if track is not None}
         id_to_features = {features.id: features for features in features_results if features is not None}
         spotify_tracks = []
         for id in id_to_track.keys():
             # get data from call to tracks endpoint
             track = id_to_track[id]
-            links = Link.from_df(matches[matches["sid"] == id])
+            track_links = links.for_sid(id)
             title = track["name"]
-            year_first_released = int(track["album"]["release_date"][:3])
+            year_first_released = int(track["album"]["release_date"][:4])
             duration_ms = track["duration_ms"]
             popularity = track["popularity"]
             album = Album(
@@ -319,9 +509,9 @@ class SpotifyTrack(BaseModel):
             ]
 
             # feature data
-            if id_to_features.get("id") is not None:
+            if id_to_features.get(id) is not None:
                 has_features = True
-                features = id_to_features["id"]
+                features = id_to_features[id]
             else:
                 has_features = False
                 features = None
@@ -329,7 +519,7 @@ class SpotifyTrack(BaseModel):
             spotify_tracks.append(
                 SpotifyTrack(
                     id=id,
-                    links=links,
+                    links=track_links,
                     title=title,
                     album=album,
                     artists=artists,
@@ -0,0 +1,136 @@
+""" Overlapped load: Spotify fetching, MIDI scoring and database writes at the same time.
+
+    The fetch and score stages each run on their own thread and hand what they finish
+    to the writer through one bounded queue. The writer stays on the calling thread and
+    is the only user of the database. When it falls behind, the queue fills up and the
+    stages block on it. The score stage in turn only keeps a few files per worker in
+    its process pool (see score_midis), so memory stays flat however far ahead the
+    network or the worker processes could run.
+"""
+import queue
+import threading
+from multiprocessing import get_all_start_methods
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterable, NamedTuple, Optional, Union
+
+from ._utils import PROCS, QUEUE_SIZE
+from .cache import ScoreCache, TrackCache
+from .features import FeatureStore
+from .metrics import Metrics
+from .models import DEFAULT_MODELS, MIDI, LinkIndex, SpotifyTrack
+from .scoring import ScoringFailure, score_midis
+from .spotify_fetch import SpotifyFetcher
+
+# the score stage starts its pool while the fetch thread is running, which fork does not survive reliably
+MP_CONTEXT: str = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+PUT_TIMEOUT: float = 0.1 # seconds between checks for a stopped pipeline while the queue is full
+
+class _Done(NamedTuple):
+    """Sent by a stage after its last item."""
+
+class _Failed(NamedTuple):
+    """Sent by a stage in place of the item it failed to produce."""
+    error: BaseException
+
+class Pipeline:
+    """ Producer stages on threads feeding one consumer through a bounded queue.
+        Add stages with stage(), then iterate results() on the consuming thread."""
+
+    def __init__(self, maxsize: int = QUEUE_SIZE, metrics: Optional[Metrics] = None):
+        self.queue: queue.Queue = queue.Queue(maxsize)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.gauge("queue_depth", self.queue.qsize)
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def stage(self, name: str, produce: Callable[[], Iterable]):
+        """ Run produce() on its own thread and queue every item it yields as (name, item).
+            produce is called on that thread, so it can open resources (like sqlite3
+            connections) that must only be used there."""
+        self._threads.append(threading.Thread(target=self._run, args=(name, produce), name=name, daemon=True))
+
+    def results(self) -> Generator[tuple[str, Any], None, None]:
+        """ Start every stage and yield (stage name, item) until all of them are done, in
+            the order items were finished. An exception in a stage is raised here, and
+            leaving the loop early (or raising in it) stops the remaining stages."""
+        for thread in self._threads:
+            thread.start()
+        running = len(self._threads)
+        try:
+            while running:
+                # time the writer spends idle, waiting on the producers
+                with self.metrics.time("queue_wait"):
+                    name, item = self.queue.get()
+                if isinstance(item, _Done):
+                    running -= 1
+                elif isinstance(item, _Failed):
+                    raise item.error
+                else:
+                    self.metrics.inc(f"{name}_items")
+                    yield name, item
+        finally:
+            self._stop.set()
+            for thread in self._threads:
+                thread.join()
+
+    def _run(self, name: str, produce: Callable[[], Iterable]):
+        items = None
+        try:
+            items = iter(produce())
+            for item in items:
+                if not self._put((name, item)):
+                    break
+        except BaseException as e:
+            self._put((name, _Failed(e)))
+        finally:
+            # a stage that was stopped early still releases its pool, event loop and cache
+            if hasattr(items, "close"):
+                items.close()
+            self._put((name, _Done()))
+
+    def _put(self, item: tuple[str, Any]) -> bool:
+        """Block while the queue is full. False if the pipeline was stopped meanwhile."""
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+def spotify_stage(
+        fetcher: SpotifyFetcher,
+        sid_chunks: list[list[str]],
+        links: LinkIndex,
+        feature_store: FeatureStore,
+        cache_path: Optional[Path] = None,
+        cache_ttl: Optional[float] = None,
+) -> Generator[tuple[list[str], list[SpotifyTrack]], None, None]:
+    """Fetch stage: (ids, SpotifyTracks) per batch, through a track cache at cache_path if given."""
+    cache = None if cache_path is None else TrackCache(cache_path, ttl=cache_ttl)
+    try:
+        yield from fetcher.tracks(sid_chunks, links, feature_store, cache=cache)
+    finally:
+        if cache is not None:
+            cache.close()
+
+def midi_stage(
+        paths: list[Path],
+        links: LinkIndex,
+        procs: int = PROCS,
+        cache_path: Optional[Path] = None,
+        metrics: Optional[Metrics] = None,
+        models: Iterable[str] = DEFAULT_MODELS,
+        groups: bool = False,
+        **budget,
+) -> Generator[Union[MIDI, ScoringFailure], None, None]:
+    """ Score stage: MIDI files scored with the named models by the worker pool, in roughly
+        the order of paths, through a score cache at cache_path if given, and by instrument
+        group as well with groups. budget is passed on to score_midis (timeout, memory_mb,
+        recycle_after)."""
+    cache = None if cache_path is None else ScoreCache(cache_path)
+    try:
+        yield from score_midis(paths, links, procs=procs, cache=cache, mp_context=MP_CONTEXT, metrics=metrics, models=models, groups=groups, **budget)
+    finally:
+        if cache is not None:
+            cache.close()
@@ -0,0 +1,303 @@
+""" Process-pool scoring stage for MIDI files.
+
+    Worker processes only parse and score MIDI files. The parent attaches links,
+    builds the MIDI objects and stays the only process that touches the sqlite3
+    connection (and the score cache).
+
+    Each file is scored under a wall-clock budget (SIGALRM) and each worker under a
+    memory budget (RLIMIT_AS), where the platform has them. A file that runs over
+    either, or fails to parse, comes back as a ScoringFailure instead of stopping the
+    run, and workers are replaced after a number of files so leaks cannot pile up.
+    SIGALRM only interrupts Python code, so the parent also watches the workers: one
+    still on a file KILL_GRACE seconds past its budget is killed, one that died (a
+    segfault, the OOM killer) is noticed, and either way the pool starts a replacement
+    and the file is recorded as a ScoringFailure.
+
+    Only a few files per worker are handed to the pool at a time, and more are handed
+    over as the caller takes results, so a caller that falls behind holds the workers
+    back instead of letting finished scores pile up inside the pool.
+"""
+import os
+import queue
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from itertools import count, islice
+from multiprocessing import get_context
+from multiprocessing.pool import Pool
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterable, Iterator, NamedTuple, Optional, Union
+
+from ._utils import CHUNKSIZE, FILE_TIMEOUT, PROCS, RECYCLE_AFTER
+from .cache import ScoreCache
+from .metrics import Metrics
+from .models import DEFAULT_MODELS, MIDI, MODELS, LinkIndex
+
+try:
+    import resource
+except ImportError: # not on Windows
+    resource = None
+
+# the cache parameters of outputs scored by instrument group as well
+GROUP_PARAMETERS: dict = {"groups": True}
+KILL_GRACE: float = 30.0 # seconds past its time budget before the worker on a file is killed
+WATCH_INTERVAL: float = 1.0 # seconds between checks on the workers for stuck or dead ones
+
+# in a worker process, the queue it reports every task it starts to (see _started)
+_starts = None
+
+class ScoringFailure(NamedTuple):
+    """ A file that could not be scored. Field order matches the midi_failures
+        columns, so ScoringFailures can go straight into executemany."""
+    md5: str
+    reason: str
+    seconds: float
+
+class BudgetExceeded(Exception):
+    pass
+
+@contextmanager
+def time_budget(seconds: Optional[float]) -> Generator[None, None, None]:
+    """ Raise BudgetExceeded in the block once it has run for `seconds`. Needs SIGALRM and the
+        main thread, so it only applies in worker processes (and is a no-op elsewhere)."""
+    if not seconds or not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise BudgetExceeded(f"over the {seconds:g}s time budget")
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _init_worker(memory_mb: Optional[int], starts=None):
+    """ Cap the address space of a worker process at memory_mb, so a runaway file raises MemoryError,
+        and report the tasks it starts to the starts queue, if given."""
+    global _starts
+    _starts = starts
+    if memory_mb and resource is not None:
+        limit = memory_mb * 1024 * 1024
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def _started(score: Callable[[Any], Any], n: int, task: Any) -> tuple[int, Any]:
+    """Run task n in a worker process, after telling the parent which process started it and when."""
+    if _starts is not None:
+        _starts.put((n, os.getpid(), time.time()))
+    return n, score(task)
+
+def _score(task: tuple[Path, tuple[str, ...], Optional[float], bool]) -> tuple[str, Union[dict[str, dict], str], dict[str, float]]:
+    """ Score a single MIDI file with the named models (and by instrument group, if asked) inside
+        a worker process, timing each step. Returns the outputs by model, or the reason the file
+        failed in their place."""
+    path, models, timeout, groups = task
+    timings = {}
+    start = time.perf_counter()
+    try:
+        with time_budget(timeout):
+            return path.stem, MIDI.score(path, models, timings=timings, groups=groups), timings
+    except BudgetExceeded as e:
+        reason = str(e)
+    except MemoryError:
+        reason = "over the memory budget"
+    except Exception as e:
+        reason = f"{type(e).__name__}: {e}"
+    timings["failed"] = time.perf_counter() - start
+    return path.stem, reason, timings
+
+def score_midis(
+        paths: Iterable[Path],
+        links: LinkIndex,
+        procs: int = PROCS,
+        chunksize: int = CHUNKSIZE,
+        cache: Optional[ScoreCache] = None,
+        mp_context: Optional[str] = None,
+        metrics: Optional[Metrics] = None,
+        models: Iterable[str] = DEFAULT_MODELS,
+        timeout: Optional[float] = FILE_TIMEOUT,
+        memory_mb: Optional[int] = None,
+        recycle_after: Optional[int] = RECYCLE_AFTER,
+        groups: bool = False,
+) -> Generator[Union[MIDI, ScoringFailure], None, None]:
+    """ Score MIDI files with every named model (WNBD always included) on `procs` worker
+        processes and yield MIDI objects as they finish. Each file is parsed once for all
+        of its models. Files with every model in `cache` are yielded first without being
+        parsed, files with only some of them are scored with just the missing ones, and
+        new outputs are added to the cache. Results arrive in completion order, not input
+        order. With procs <= 1 and neither a timeout nor a memory_mb budget, the files are
+        scored in-process, one at a time; with a budget they go to a pool of one worker
+        process, where the budgets can be enforced and watched. mp_context
+        is the multiprocessing start method for the workers (the platform default if None).
+        With metrics, the workers' parse/segment/score times and the cache hits are
+        recorded there.
+
+        A file that takes longer than timeout seconds, pushes its worker past memory_mb,
+        or raises is yielded as a ScoringFailure, and so is one whose worker is still on it
+        KILL_GRACE seconds later (the worker is killed) or died on it. Workers are replaced after scoring about
+        recycle_after files (None or 0 keeps them for the whole run). At most procs * chunksize
+        files are in the pool or finished and waiting for the caller at any time.
+
+        With groups, every model also scores each instrument group of the file (see MIDI.score)
+        and the MIDI objects carry instrument_scores. Those outputs are cached apart from the
+        plain ones, so a run with groups does not take a cached score without them."""
+    metrics = metrics if metrics is not None else Metrics()
+    models = tuple(dict.fromkeys(("WNBD", *models)))
+    parameters = GROUP_PARAMETERS if groups else None
+    tasks, partial = [], {}
+    for path in paths:
+        cached = {}
+        if cache is not None:
+            for name in models:
+                scores = cache.get(path.stem, MODELS[name], parameters)
+                if scores is not None:
+                    cached[name] = scores
+        missing = tuple(name for name in models if name not in cached)
+        if missing:
+            tasks.append((path, missing, timeout, groups))
+            if cached:
+                partial[path.stem] = cached
+        else:
+            metrics.inc("midi_cache_hits")
+            yield MIDI.from_scores(path.stem, cached, links.for_md5(path.stem))
+
+    if procs <= 1 and not timeout and not memory_mb:
+        yield from _collect(map(_score, tasks), links, cache, metrics, partial, parameters)
+        return
+    procs = max(procs, 1)
+
+    # every file is one task of the pool
+    context = get_context(mp_context)
+    # workers can only be watched where they can be killed
+    # a SimpleQueue writes in the caller, so a start is reported even if the worker dies right after
+    starts = context.SimpleQueue() if hasattr(signal, "SIGKILL") else None
+    pool = context.Pool(
+        processes=procs,
+        initializer=_init_worker,
+        initargs=(memory_mb, starts),
+        maxtasksperchild=recycle_after or None,
+    )
+    def lost(task: tuple, reason: str, seconds: float) -> tuple[str, str, dict[str, float]]:
+        return task[0].stem, reason, {"failed": seconds}
+    with pool:
+        results = _windowed(
+            pool,
+            _score,
+            tasks,
+            window=procs * chunksize,
+            starts=starts,
+            deadline=timeout + KILL_GRACE if timeout else None,
+            lost=lost,
+        )
+        yield from _collect(results, links, cache, metrics, partial, parameters)
+
+def _windowed(
+        pool: Pool,
+        score: Callable[[Any], Any],
+        tasks: Iterable,
+        window: int,
+        starts=None,
+        deadline: Optional[float] = None,
+        lost: Optional[Callable[[Any, str, float], Any]] = None,
+) -> Iterator:
+    """ score(task) for every task on the pool, in completion order. At most window tasks are
+        handed to the pool and not yet taken from here at any time; another one is handed over
+        each time the caller comes back for a result. (imap_unordered hands over every task at
+        once and keeps what finishes in the pool, however far behind the caller is.)
+
+        With starts, the queue the pool's workers were initialized with (see _init_worker), the
+        workers are watched: the one on a task for more than deadline seconds is killed, and a
+        task whose worker died is given up on. Either way the pool replaces the worker, and
+        lost(task, reason, seconds) is yielded in place of the task's result."""
+    tasks = iter(tasks)
+    finished: queue.Queue = queue.Queue()
+    pending: dict[int, Any] = {} # handed over and not yet finished, by task number
+    running: dict[int, tuple[int, float]] = {} # (pid, start time) of the pending tasks a worker started
+    numbers = count()
+
+    def submit(task):
+        n = next(numbers)
+        pending[n] = task
+        pool.apply_async(_started, (score, n, task), callback=finished.put, error_callback=finished.put)
+
+    for task in islice(tasks, window):
+        submit(task)
+    while pending:
+        try:
+            item = finished.get(timeout=None if starts is None else WATCH_INTERVAL)
+        except queue.Empty:
+            item = _overdue(pool, pending, running, starts, deadline, lost)
+            if item is None:
+                continue
+        if isinstance(item, BaseException):
+            raise item
+        n, result = item
+        if pending.pop(n, None) is None:
+            continue # finished after all, but already given up on
+        running.pop(n, None)
+        yield result
+        for task in islice(tasks, 1):
+            submit(task)
+
+def _overdue(
+        pool: Pool,
+        pending: dict[int, Any],
+        running: dict[int, tuple[int, float]],
+        starts,
+        deadline: Optional[float],
+        lost: Callable[[Any, str, float], Any],
+) -> Optional[tuple[int, Any]]:
+    """ The first pending task whose worker died or ran past deadline (and is killed here), as
+        (task number, lost(task, reason, seconds)), or None if every worker is still in time.
+        Workers are looked up among the pool's own processes, never killed by bare pid: once
+        the pool has reaped a dead worker, its pid may already belong to another process."""
+    while not starts.empty():
+        n, pid, start = starts.get()
+        if n in pending:
+            running[n] = (pid, start)
+    now = time.time()
+    workers = {process.pid: process for process in pool._pool}
+    for n, (pid, start) in list(running.items()):
+        if n not in pending:
+            del running[n]
+            continue
+        worker = workers.get(pid)
+        if worker is None or not worker.is_alive():
+            reason = "worker process died"
+        elif deadline is not None and now - start > deadline:
+            worker.kill()
+            reason = f"timed out: still running after {deadline:g}s, worker killed"
+        else:
+            continue
+        del running[n]
+        return n, lost(pending[n], reason, now - start)
+    return None
+
+def _collect(
+        results: Iterable[tuple[str, Union[dict[str, dict], str], dict[str, float]]],
+        links: LinkIndex,
+        cache: Optional[ScoreCache],
+        metrics: Metrics,
+        partial: dict[str, dict[str, dict]],
+        parameters: Optional[dict] = None,
+) -> Generator[Union[MIDI, ScoringFailure], None, None]:
+    """ Attach links to freshly scored files, add their outputs to the cache and merge in the
+        outputs that were already cached, on their way back to the caller."""
+    for md5, scores, timings in results:
+        metrics.observe_all(timings)
+        if isinstance(scores, str):
+            metrics.inc("midi_files_failed")
+            partial.pop(md5, None)
+            yield ScoringFailure(md5, scores, timings["failed"])
+            continue
+        metrics.inc("midi_files_scored")
+        if cache is not None:
+            for name, output in scores.items():
+                cache.put(md5, MODELS[name], output, parameters)
+        scores = {**partial.pop(md5, {}), **scores}
+        yield MIDI.from_scores(md5, scores, links.for_md5(md5))
@@ -0,0 +1,63 @@
+""" Deterministic partition of a load into N shards that can run on separate machines.
+
+    MIDI files are split by the first three hex digits of their md5, which is the
+    directory they live in (md5[0]/md5[1]/md5[2]/), so a shard reads whole directories.
+    Spotify ids are split by a hash of the id instead of following their MIDI files:
+    an id linked to files in several shards is then still fetched by only one of them.
+    Every shard writes its own database file, and the merge_shards command combines them.
+"""
+import argparse
+import sqlite3
+import zlib
+from pathlib import Path
+from typing import NamedTuple
+
+MD5_PREFIX_LENGTH: int = 3 # hex digits of the md5 that make up its MMD directory
+
+class Shard(NamedTuple):
+    """Shard `index` of `count`. Shard(0, 1), the default, is the whole load."""
+    index: int = 0
+    count: int = 1
+
+    @classmethod
+    def parse(cls, spec: str) -> "Shard":
+        """Parse an "i/N" command line argument, with 0 <= i < N."""
+        try:
+            index, count = map(int, spec.split("/"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"expected a shard as i/N, got {spec!r}")
+        if not 0 <= index < count:
+            raise argparse.ArgumentTypeError(f"shard index must be in [0, {count}), got {index}")
+        return cls(index, count)
+
+    @property
+    def is_partial(self) -> bool:
+        return self.count > 1
+
+    def has_md5(self, md5: str) -> bool:
+        return int(md5[:MD5_PREFIX_LENGTH], 16) % self.count == self.index
+
+    def has_sid(self, sid: str) -> bool:
+        return zlib.crc32(sid.encode()) % self.count == self.index
+
+    def path(self, out: Path) -> Path:
+        """Database file of this shard next to out, e.g. data.shard-1-of-4.sqlite3 (out itself for the whole load)."""
+        if not self.is_partial:
+            return out
+        return out.with_name(f"{out.stem}.shard-{self.index}-of-{self.count}{out.suffix}")
+
+def copy_schema(source: Path, target: Path):
+    """Create every table and index of the (dbt-built) database at source in a new database at target."""
+    assert not target.exists(), f"{target} already exists."
+    db = sqlite3.connect(source)
+    statements = [sql for sql, in db.execute(
+        "select sql from sqlite_master"
+        " where type in ('table', 'index') and sql is not null and name not like 'sqlite_%'"
+        " order by type = 'index'"
+    )]
+    db.close()
+    db = sqlite3.connect(target)
+    for sql in statements:
+        db.execute(sql)
+    db.commit()
+    db.close()
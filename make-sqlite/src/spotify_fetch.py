@@ -0,0 +1,193 @@
+""" asyncio fetcher for the Spotify tracks endpoint.
+
+    Several 50-id batches are kept in flight at once. Every request first takes a
+    token from one shared TokenBucket, and a 429 pauses that bucket for the
+    retry-after period, so a rate limit hit by one batch holds back all of them
+    instead of each batch hammering the API on its own schedule.
+"""
+import asyncio
+import time
+from typing import AsyncGenerator, Generator, Iterable, Optional
+import requests
+
+from ._utils import SPOTIFY_BATCH_SIZE, SPOTIFY_CONCURRENCY, SPOTIFY_RATE
+from .cache import TrackCache
+from .features import FeatureStore
+from .metrics import Metrics
+from .models import LinkIndex, SpotifyAPI, SpotifyTrack
+
+RETRY_WAIT: float = 5.0 # seconds to wait after a connection error or a 503
+
+class LoopLock:
+    """ An asyncio.Lock for whichever event loop is running. An asyncio.Lock belongs to the
+        loop it is first waited on, and SpotifyFetcher.tracks runs a new loop per call, so
+        every new loop gets a new lock."""
+
+    def __init__(self):
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._lock, self._loop = asyncio.Lock(), loop
+        return self._lock
+
+class TokenBucket:
+    """ Rate limiter shared by every in-flight request: `rate` requests per second
+        on average, bursts of up to `capacity`, and a global pause for retry-after."""
+
+    def __init__(self, rate: float = SPOTIFY_RATE, capacity: int = SPOTIFY_CONCURRENCY):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = LoopLock()
+
+    async def acquire(self):
+        """Wait for a token. Waiters are served in order, one at a time."""
+        async with self._lock.get():
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Hold back every request, including ones already waiting, for `seconds`."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+class SpotifyFetcher:
+    """ Fetches tracks for many 50-id batches concurrently. The blocking HTTP calls run
+        on the default thread pool through the API's pooled session; scheduling, retries
+        and rate limiting run on the loop."""
+
+    def __init__(
+            self,
+            api: SpotifyAPI,
+            concurrency: int = SPOTIFY_CONCURRENCY,
+            limiter: Optional[TokenBucket] = None,
+            max_retries: int = 5,
+            metrics: Optional[Metrics] = None,
+    ):
+        self.api = api
+        self.concurrency = concurrency
+        self.limiter = limiter if limiter is not None else TokenBucket(capacity=concurrency)
+        self.max_retries = max_retries
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._auth_lock = LoopLock()
+
+    async def _token(self, refresh: bool = False) -> str:
+        """The API token, requested by only one batch at a time."""
+        async with self._auth_lock.get():
+            if refresh:
+                await asyncio.to_thread(self.api._send_auth_request)
+            return await asyncio.to_thread(self.api.token)
+
+    async def fetch(self, ids: list[str]) -> list[Optional[dict]]:
+        """GET one batch of up to 50 tracks, retrying through rate limits and transient errors."""
+        assert len(ids) <= 50, "Must request less than 50 tracks at a time."
+        endpoint = self.api.api_url + "/tracks?ids=" + ",".join(ids)
+        for i in range(self.max_retries):
+            with self.metrics.time("rate_limit_wait"):
+                await self.limiter.acquire()
+            token = await self._token()
+            self.metrics.inc("spotify_requests")
+            try:
+                with self.metrics.time("fetch"):
+                    response = await asyncio.to_thread(
+                        self.api.session.get, endpoint, headers={"Authorization": "Bearer " + token}
+                    )
+            except requests.exceptions.RequestException as e:
+                self.metrics.inc("spotify_errors")
+                print(f"\nAn error occured while trying to request tracks, waiting {RETRY_WAIT} seconds then retrying: {e}\n")
+                await asyncio.sleep(RETRY_WAIT)
+                continue
+
+            if response.status_code != 200:
+                self.metrics.inc(f"spotify_http_{response.status_code}")
+            if response.status_code == 429:
+                wait_time = int(response.headers.get("retry-after", 1))
+                print(f"\nRate limit exceeded. Pausing all requests for {wait_time} seconds then retrying...")
+                self.limiter.pause(wait_time)
+            elif response.status_code == 503:
+                print(f"\nTracks request failed with code 503. Waiting then retrying...\n")
+                await asyncio.sleep(RETRY_WAIT)
+            elif response.status_code in (401, 502):
+                print(f"\nRequest failed with code {response.status_code}. Refreshing auth token and retrying...\n")
+                await self._token(refresh=True)
+            else:
+                try:
+                    response.raise_for_status()
+                except requests.exceptions.HTTPError as e:
+                    print(f"\nAn error occured while trying to request tracks: {e}\n")
+                    raise
+                return response.json()["tracks"]
+        print("\nMax retries exceeded for tracks request. Rerun with --append to retry these ids.\n")
+        raise RuntimeError
+
+    async def fetch_all(self, id_batches: Iterable[list[str]]) -> AsyncGenerator[tuple[list[str], list[Optional[dict]]], None]:
+        """Yield (ids, tracks) for every batch as it completes, with up to `concurrency` batches in flight."""
+        batches = iter(id_batches)
+        pending: dict[asyncio.Task, list[str]] = {}
+        try:
+            while True:
+                while len(pending) < self.concurrency:
+                    ids = next(batches, None)
+                    if ids is None:
+                        break
+                    pending[asyncio.ensure_future(self.fetch(ids))] = ids
+                if not pending:
+                    return
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield pending.pop(task), task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def tracks(
+            self,
+            id_batches: Iterable[list[str]],
+            links: LinkIndex,
+            feature_store: FeatureStore,
+            cache: Optional[TrackCache] = None,
+    ) -> Generator[tuple[list[str], list[SpotifyTrack]], None, None]:
+        """ Synchronous wrapper around fetch_all that yields (ids, SpotifyTracks) per batch.
+            The event loop only runs while the caller waits for the next batch.
+
+            With a cache, ids it has a fresh response for are yielded first without any
+            request, and only the misses are regrouped into full batches and fetched."""
+        if cache is not None:
+            ids = [id for batch in id_batches for id in batch]
+            cached = cache.get_many(ids)
+            hits = list(cached)
+            self.metrics.inc("spotify_cache_hits", len(hits))
+            for pos in range(0, len(hits), SPOTIFY_BATCH_SIZE):
+                batch = hits[pos : pos + SPOTIFY_BATCH_SIZE]
+                yield batch, SpotifyTrack.from_api(batch, [cached[id] for id in batch], links, feature_store)
+            misses = [id for id in ids if id not in cached]
+            id_batches = [misses[pos : pos + SPOTIFY_BATCH_SIZE] for pos in range(0, len(misses), SPOTIFY_BATCH_SIZE)]
+
+        loop = asyncio.new_event_loop()
+        batches = self.fetch_all(id_batches)
+        try:
+            while True:
+                try:
+                    ids, track_results = loop.run_until_complete(batches.__anext__())
+                except StopAsyncIteration:
+                    return
+                if cache is not None:
+                    cache.put_many(ids, track_results)
+                yield ids, SpotifyTrack.from_api(ids, track_results, links, feature_store)
+        finally:
+            loop.run_until_complete(batches.aclose())
+            loop.close()
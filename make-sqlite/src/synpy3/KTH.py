@@ -4,13 +4,16 @@ Institution: Centre for Digital Music, Queen Mary University of London
 
 '''
 
-from basic_functions import get_note_indices, repeat, velocity_sequence_to_min_timespan
+from .basic_functions import get_note_indices, repeat, velocity_sequence_to_min_timespan
 
 # To find the nearest power of 2 equal to or less than the given number
 def round_down_power_2(number):
 	i = 0
 	if number > 0:
-		while pow(2,i) > number or number >= pow(2,i+1):
+		# notes shorter than deltaT give numbers below 1, whose power is negative
+		while pow(2,i) > number:
+			i = i-1
+		while number >= pow(2,i+1):
 			i = i+1
 		power2 = pow(2,i)
 	else:
@@ -75,9 +78,9 @@ def get_syncopation(bar, parameters = None):
 			c_n = round_down_power_2(note.duration/deltaT)
 			#print 'd', note.duration
 			#print 'c_n', c_n
-			endTime = note.startTime + note.duration
+			endTime = note.start + note.duration
 			#print float(note.startTime)/deltaT, float(endTime)/deltaT
-			syncopation = syncopation + start_time_offbeat_measure(float(note.startTime)/deltaT,c_n) + end_time_offbeat_measure(float(endTime)/deltaT,c_n)
+			syncopation = syncopation + start_time_offbeat_measure(float(note.start)/deltaT,c_n) + end_time_offbeat_measure(float(endTime)/deltaT,c_n)
 
 
 	return syncopation
@@ -0,0 +1,110 @@
+"""
+Meter and tempo of a MIDI file as lookups by tick.
+
+A MeterMap or TempoMap is built once per file from its time signature or tempo
+changes and answers "what is in effect at tick t" with a bisect, so segmentation,
+scoring and anything tempo-aware can share one instead of rescanning the change
+lists. The change in effect at t is the last one at or before t (the last in file
+order among changes at the same tick); before the first change, the first one
+applies.
+"""
+from bisect import bisect_right
+from typing import Iterator, Sequence
+
+import numpy as np
+
+from .basic_functions import calculate_bar_ticks
+from .music_objects import TimeSignature
+
+def _sorted_changes(changes: Sequence, name: str) -> list:
+	if len(changes) == 0:
+		raise ValueError("MIDI file has no %s" % name)
+	return sorted(changes, key=lambda change: change.time) # stable, so file order breaks ties
+
+class TempoMap:
+	""" Tempo by tick, from miditoolkit-style tempo changes (.tempo in quarter notes per minute, .time in ticks) """
+
+	def __init__(self, tempo_changes: Sequence):
+		self.changes = _sorted_changes(tempo_changes, "tempo")
+		self.ticks = [change.time for change in self.changes]
+
+	def index(self, tick: float) -> int:
+		""" index in self.changes of the change in effect at tick """
+		return max(bisect_right(self.ticks, tick) - 1, 0)
+
+	def indexes(self, ticks: np.ndarray) -> np.ndarray:
+		""" index for each of many ticks at once """
+		return np.maximum(np.searchsorted(self.ticks, ticks, side="right") - 1, 0)
+
+	def change(self, tick: float):
+		return self.changes[self.index(tick)]
+
+	def tempo(self, tick: float) -> float:
+		return self.changes[self.index(tick)].tempo
+
+class MeterMap:
+	""" Time signature and bar layout by tick, from miditoolkit-style time signature changes
+	(.numerator, .denominator, .time in ticks). Bars are laid out from tick 0 and a bar keeps
+	the time signature in effect at its start, so a change in the middle of a bar takes
+	effect at the next bar line. """
+
+	def __init__(self, time_signature_changes: Sequence, ticks_per_beat: int):
+		self.changes = _sorted_changes(time_signature_changes, "time signature")
+		self.ticks = [change.time for change in self.changes]
+		self.ticks_per_beat = ticks_per_beat
+		self.bar_lengths = [calculate_bar_ticks(change.numerator, change.denominator, ticks_per_beat) for change in self.changes]
+		self._time_signatures = {}
+
+	def index(self, tick: float) -> int:
+		""" index in self.changes of the time signature in effect at tick """
+		return max(bisect_right(self.ticks, tick) - 1, 0)
+
+	def indexes(self, ticks: np.ndarray) -> np.ndarray:
+		""" index for each of many ticks at once """
+		return np.maximum(np.searchsorted(self.ticks, ticks, side="right") - 1, 0)
+
+	def meter(self, tick: float) -> tuple[int, int]:
+		change = self.changes[self.index(tick)]
+		return change.numerator, change.denominator
+
+	def bar_length(self, tick: float) -> float:
+		""" length in ticks of a bar starting at tick """
+		return self.bar_lengths[self.index(tick)]
+
+	def time_signature(self, index: int) -> TimeSignature:
+		""" the synpy3 TimeSignature of change index, one per meter (each one reads TimeSignature.pkl) """
+		meter = (self.changes[index].numerator, self.changes[index].denominator)
+		if meter not in self._time_signatures:
+			self._time_signatures[meter] = TimeSignature("%d/%d" % meter)
+		return self._time_signatures[meter]
+
+	def iter_bars(self) -> Iterator[tuple[float, float]]:
+		""" (start, length) of every bar, without end """
+		start = 0.0
+		while True:
+			length = self._checked_length(self.index(start))
+			yield start, length
+			start += length
+
+	def bars_until(self, tick: float) -> tuple[np.ndarray, np.ndarray]:
+		""" start and length of every bar up to the one holding tick, as arrays. Within the span
+		of one time signature the bar length is fixed, so its bars are one arange. """
+		starts, lengths = [], []
+		start = 0.0
+		for k in range(self.index(0), len(self.changes)):
+			spanEnd = self.ticks[k + 1] if k + 1 < len(self.ticks) else np.inf
+			if start >= spanEnd:
+				continue # a bar that started earlier runs past this change, or another change at its tick follows
+			length = self._checked_length(k)
+			count = min(np.ceil((spanEnd - start) / length), np.floor((tick - start) / length) + 1)
+			starts.append(start + np.arange(count) * length)
+			lengths.append(np.full(len(starts[-1]), length))
+			start += count * length
+			if start > tick:
+				break
+		return np.concatenate(starts), np.concatenate(lengths)
+
+	def _checked_length(self, index: int) -> float:
+		if self.bar_lengths[index] <= 0:
+			raise ValueError("time signature %d/%d has no length" % (self.changes[index].numerator, self.changes[index].denominator))
+		return self.bar_lengths[index]
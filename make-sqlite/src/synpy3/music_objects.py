@@ -2,7 +2,9 @@
 from .basic_functions import ceiling, string_to_sequence, calculate_bar_ticks, velocity_sequence_to_min_timespan
 from . import parameter_setter 
 from . import rhythm_parser 
+from typing import NamedTuple
 import miditoolkit
+import numpy as np
 
 class Note():
 	def __init__(self, firstarg = None, duration = None, velocity = None):
@@ -50,6 +52,86 @@ class NoteSequence(list):
 		return noteSequenceString[:-1]
 
 
+class TableNote(NamedTuple):
+	""" one row of a NoteView, with start and end relative to the bar """
+	start: float
+	end: float
+	pitch: int
+	velocity: int
+	instrument: int
+
+	@property
+	def duration(self):
+		return self.end - self.start
+
+	def to_string(self):
+		return "(%d,%d,%f)" %(self.start, self.duration, self.velocity)
+
+
+# NoteView stands in for the NoteSequence of one bar of a MIDI file: a slice of the file's note table
+# (smf.Notes), whose columns are views rather than copies, and the bar's start tick. Notes are made
+# bar-relative as they are read, so the table itself is never changed and can be segmented again.
+# It is a read-only sequence of TableNotes rather than a list, so nothing can reach an empty list
+# behind it; make a NoteSequence from it for anything that needs list methods.
+class NoteView:
+	def __init__(self, notes, offset):
+		self.notes = notes
+		self.offset = offset
+
+	def __len__(self):
+		return len(self.notes.start)
+
+	def __iter__(self):
+		offset = self.offset
+		for start, end, pitch, velocity, instrument in zip(*(column.tolist() for column in self.notes)):
+			yield TableNote(start - offset, end - offset, pitch, velocity, instrument)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			first, last, step = index.indices(len(self))
+			if step != 1:
+				raise ValueError("NoteView slices must be contiguous, got step %d" % step)
+			return NoteView(self.notes.slice(first, max(first, last)), self.offset)
+		start, end, pitch, velocity, instrument = (column[index].item() for column in self.notes)
+		return TableNote(start - self.offset, end - self.offset, pitch, velocity, instrument)
+
+	def __eq__(self, other):
+		if isinstance(other, (NoteView, list)):
+			return list(self) == list(other)
+		return NotImplemented
+
+	__hash__ = None
+
+	def __repr__(self):
+		return "NoteView(%r)" % list(self)
+
+	def to_string(self):
+		return ",".join(note.to_string() for note in self)
+
+	def starts(self):
+		""" bar-relative onsets, as an array """
+		return self.notes.start - self.offset
+
+	def velocity_sequence(self, timespanTicks):
+		""" note_sequence_to_velocity_sequence for a bar, computed on the columns """
+		starts = self.starts()
+		# only the first note of a chord counts
+		first = np.ones(len(starts), dtype=bool)
+		first[1:] = starts[1:] != starts[:-1]
+		starts, velocities = starts[first], self.notes.velocity[first].astype(np.int64)
+		# each onset lands int(interOnsetInterval - 1) + 1 places after the previous one
+		steps = np.trunc(np.diff(starts, prepend=-1) - 1).astype(np.int64) + 1
+		positions = np.cumsum(steps) - 1
+
+		length = positions[-1] + 1 if len(positions) else 0
+		sequence = np.zeros(length + max(int(timespanTicks - length), 0))
+		sequence[positions] = velocities
+		peak = velocities.max() if len(velocities) else 0
+		if peak > 0:
+			return VelocitySequence((sequence / peak).tolist())
+		return VelocitySequence([0] * len(sequence))
+
+
 class NormalisedVelocityValueOutOfRange(Exception):
 	def __init__(self, value):
 		self.value = value
@@ -114,6 +196,9 @@ def velocity_sequence_to_note_sequence(velocitySequence, nextbarVelocitySequence
 
 def note_sequence_to_velocity_sequence(noteSequence, timespanTicks = None):
 
+	if isinstance(noteSequence, NoteView) and timespanTicks != None:
+		return noteSequence.velocity_sequence(timespanTicks)
+
 	velocitySequence = VelocitySequence()
 	
 	previousNoteStartTime = -1
@@ -134,8 +219,9 @@ def note_sequence_to_velocity_sequence(noteSequence, timespanTicks = None):
 		velocitySequence += [0]*(noteSequence[-1].duration-1)
 
 	# normalising velocity sequence between 0-1
-	if max(velocitySequence)>0:
-		velocitySequence = VelocitySequence([float(v)/max(velocitySequence) for v in velocitySequence])
+	peak = max(velocitySequence)
+	if peak>0:
+		velocitySequence = VelocitySequence([float(v)/peak for v in velocitySequence])
 
 	return velocitySequence
 
@@ -171,12 +257,13 @@ class BarList(list):
 
 class Bar:
 	def __init__(self, rhythmSequence, timeSignature, ticksPerQuarter=None, qpmTempo=None, nextBar=None, prevBar=None):
-		if isinstance(rhythmSequence, NoteSequence):
-			self.noteSequence = rhythmSequence
-			self.velocitySequence = None 
-		elif isinstance(rhythmSequence, VelocitySequence):
+		if isinstance(rhythmSequence, VelocitySequence):
 			self.velocitySequence = rhythmSequence
 			self.noteSequence = None 
+		else:
+			# a NoteSequence, or anything that reads like one (a NoteView)
+			self.noteSequence = rhythmSequence
+			self.velocitySequence = None 
 
 		if isinstance(timeSignature, str):
 			self.timeSignature = TimeSignature(timeSignature)
@@ -7,17 +7,14 @@ Created on Sat Mar 21 22:19:52 2015
 
 #from RhythmParser import Bar
 
-from music_objects import *
-from basic_functions import *
+from .music_objects import *
+from .basic_functions import *
+from .meter import MeterMap, TempoMap
+from .smf import SMF, Notes
 
+from typing import Sequence, Union
 from miditoolkit import MidiFile
-import miditoolkit
-
-def overloaded_lt(l: miditoolkit.Note, r: miditoolkit.Note) -> bool:
-	""" overloading the < operator in miditoolkit's Note object so sort() can be called on it """
-	return l.start < r.start
-
-miditoolkit.Note.__lt__ = overloaded_lt
+import numpy as np
 
 def read_midi_file(filename):
 	""" open and read a MIDI file, return a MidiFile object """
@@ -53,102 +50,61 @@ def read_midi_file(filename):
 	
 
 
-def get_bars_from_midi(midiFile: MidiFile):
-
-	# couple of inner functions to tidy up getting the initial values of
-	# tempo and time signature
-	
-
-
-	def get_time_signature(midiFile: MidiFile, barStartTime: float):
-		
-		timesigs = midiFile.time_signature_changes
-		for i in range(len(timesigs)):
-			if barStartTime < timesigs[i].time:
-				break
-		
-		if i != len(timesigs) - 1:
-			i -= 1
-
-		return TimeSignature.from_mtk_timesig(timesigs[i]),calculate_bar_ticks(timesigs[i].numerator, timesigs[i].denominator, midiFile.ticks_per_beat)	
-
-	def get_tempo(midiFile: MidiFile, barStartTime: float):
-		
-		tempo = None
-		i=0
-		tempos = midiFile.tempo_changes
-		for i in range(len(tempos)):
-			if barStartTime < tempos[i].time:
-				break
-
-		if i != len(tempos) - 1:
-			i -= 1
-
-		return tempos[i]
-
-
-
-
-	# get notes from the midi file (absolute start times from start of file)
-	notesList = []
-	for instrument in midiFile.instruments:
-		for note in instrument.notes:
-			notesList.append(note)
-	notesList.sort()
-	
-
-	# get initial tempo and time signature from time list
-	timesig = midiFile.time_signature_changes[0]
-	tempo = midiFile.tempo_changes[0]
-
+def get_maps(midiFile: Union[MidiFile, SMF]) -> tuple[MeterMap, TempoMap]:
+	""" the meter and tempo maps of a MIDI file; an SMF keeps its own """
+	if isinstance(midiFile, SMF):
+		return midiFile.meter_map, midiFile.tempo_map
+	return MeterMap(midiFile.time_signature_changes, midiFile.ticks_per_beat), TempoMap(midiFile.tempo_changes)
+
+def get_bars_from_midi(midiFile: Union[MidiFile, SMF]):
+	""" split the notes of a MIDI file into bars. Bar boundaries come from the file's MeterMap,
+	and every note is assigned to its bar with one searchsorted over the onsets. Each bar's
+	note sequence is a NoteView of the file's note table, so nothing is copied or changed. """
+
+	# get the note table from the midi file (absolute start times from start of file), by onset
+	if isinstance(midiFile, SMF):
+		notes = midiFile.sorted_notes
+	else:
+		notes = Notes.from_midi_file(midiFile).sorted()
+
+	if len(notes) == 0:
+		return BarList()
+	return split_into_bars(notes, get_bar_grid(midiFile, notes.start[-1]))
+
+def get_bars_by_group(midiFile: SMF, groups: dict[str, Sequence[int]]) -> dict[str, BarList]:
+	""" split the notes of each group of instruments (indexes into midiFile.instruments) into bars.
+	Every group gets the bars of the whole file, laid out once, so bar k is the same stretch of
+	the file in all of them; a group's notes are the rows of the sorted note table it plays. """
+	notes = midiFile.sorted_notes
+	if len(notes) == 0:
+		return {name: BarList() for name in groups}
+	grid = get_bar_grid(midiFile, notes.start[-1])
+	return {name: split_into_bars(notes.select(np.isin(notes.instrument, instruments)), grid) for name, instruments in groups.items()}
+
+def get_bar_grid(midiFile: Union[MidiFile, SMF], lastOnset: int) -> tuple[np.ndarray, np.ndarray, list, list, int]:
+	""" the bars of a MIDI file up to the one holding lastOnset: their starts and ends in ticks,
+	synpy3 TimeSignatures and tempo changes, and the file's ticks per quarter note """
+	# bar boundaries from the meter map, each bar taking the time signature at its start
+	meterMap, tempoMap = get_maps(midiFile)
+	barStarts, barLengths = meterMap.bars_until(lastOnset)
+	timeSignatures = [meterMap.time_signature(meter) for meter in meterMap.indexes(barStarts).tolist()]
+	tempos = [tempoMap.changes[tempo] for tempo in tempoMap.indexes(barStarts).tolist()]
+	return barStarts, barStarts + barLengths, timeSignatures, tempos, midiFile.ticks_per_beat
+
+def split_into_bars(notes: Notes, grid: tuple[np.ndarray, np.ndarray, list, list, int]) -> BarList:
+	""" a BarList over the bars of grid (see get_bar_grid) holding notes, which are sorted by start """
+	barStarts, barEnds, timeSignatures, tempos, ticksPerQuarter = grid
+
+	# the notes of bar k are rows firstNotes[k] to lastNotes[k] of the table
+	firstNotes = np.searchsorted(notes.start, barStarts, side="left")
+	lastNotes = np.searchsorted(notes.start, barEnds, side="left")
 
-
-
-	# ticks per quarter note:
-	ticksPerQuarter = midiFile.ticks_per_beat
-	#calculate the initial length of a bar in ticks
-	barlength = calculate_bar_ticks(timesig.numerator, timesig.denominator, ticksPerQuarter)
-	# initialise time for start and end of current bar
-	barStartTime = 0
-	barEndTime = 0# barlength
-	
-
-	# initialise bars list
 	bars = BarList()
-	noteIndex = 0
-
-	note = notesList[0]
-	# run through the notes list, chopping it into bars
-	while noteIndex<len(notesList):
-		#create a local note sequence to build a bar
-		currentNotes = NoteSequence()
-
-		[timesig,barlength] = get_time_signature(midiFile=midiFile, barStartTime=barStartTime)
-		
-		barEndTime = barEndTime + barlength
-
-		tempo = get_tempo(midiFile=midiFile, barStartTime=barStartTime)
-		
-
-		#find all the notes in the current bar
-		while(note.start < barEndTime):
-			#make note start time relative to current bar
-			note.start = note.start - barStartTime
-			#add note to current bar note sequence
-			currentNotes.append(note)
-			noteIndex = noteIndex + 1
-			if noteIndex<len(notesList):
-				note = notesList[noteIndex]
-			else:
-				break
+	for barStartTime, timeSignature, tempo, first, last in zip(barStarts.tolist(), timeSignatures, tempos, firstNotes.tolist(), lastNotes.tolist()):
+		# the bar's notes, with start times relative to the bar
+		currentNotes = NoteView(notes.slice(first, last), barStartTime)
 
 		# create a new bar from the current notes and add it to the list of bars
-		bars.append(Bar(currentNotes, timesig, ticksPerQuarter, tempo))
-
-		barStartTime = barEndTime
+		bars.append(Bar(currentNotes, timeSignature, ticksPerQuarter, tempo))
 
 	return bars
-
-
-
-
@@ -0,0 +1,276 @@
+"""
+Streaming reader for Standard MIDI Files that keeps only what the models use.
+
+miditoolkit goes through mido, which builds a message object for every event in
+the file before anything is kept. read_smf walks the raw bytes once and decodes
+only note-on/off, program change, set-tempo and time-signature events, straight
+into NumPy columns. Everything else is skipped by length.
+
+Notes are paired, grouped into instruments and ordered exactly like miditoolkit's
+MidiFile, so an SMF can be given to readmidi.get_bars_from_midi in place of one.
+(midiparser.py is the Python 2 parser this replaces.)
+"""
+import struct
+from functools import cached_property
+from pathlib import Path
+from typing import NamedTuple, Union
+
+import numpy as np
+from miditoolkit import TempoChange, TimeSignature
+
+from .meter import MeterMap, TempoMap
+
+DEFAULT_BPM = 120 # miditoolkit's tempo until the first set-tempo event
+
+# bytes after the status byte of each channel message, by high nibble
+CHANNEL_DATA_LENGTHS = {0x80: 2, 0x90: 2, 0xA0: 2, 0xB0: 2, 0xC0: 1, 0xD0: 1, 0xE0: 2}
+# system common and realtime messages that can appear in a track, with their data lengths
+SYSTEM_DATA_LENGTHS = {0xF1: 1, 0xF2: 2, 0xF3: 1, 0xF6: 0, 0xF8: 0, 0xFA: 0, 0xFB: 0, 0xFC: 0, 0xFE: 0}
+
+class SMFError(ValueError):
+	pass
+
+class Instrument(NamedTuple):
+	""" An instrument in miditoolkit's sense: the notes of one program on one channel of one track """
+	program: int
+	channel: int
+	track: int
+
+	@property
+	def is_drum(self) -> bool:
+		return self.channel == 9
+
+class Notes(NamedTuple):
+	""" Every note of a file as columns. instrument indexes SMF.instruments. """
+	start: np.ndarray
+	end: np.ndarray
+	pitch: np.ndarray
+	velocity: np.ndarray
+	instrument: np.ndarray
+
+	def __len__(self) -> int:
+		return len(self.start)
+
+	def slice(self, first: int, last: int) -> "Notes":
+		""" rows first to last, as views of these columns """
+		return Notes(*(column[first:last] for column in self))
+
+	def select(self, mask: np.ndarray) -> "Notes":
+		""" the rows where mask is true, as copies """
+		return Notes(*(column[mask] for column in self))
+
+	def sorted(self) -> "Notes":
+		""" The notes by start tick. Ties keep miditoolkit's order: by instrument, then by note-off. """
+		order = np.lexsort((self.instrument, self.start))
+		return Notes(*(column[order] for column in self))
+
+	@classmethod
+	def from_midi_file(cls, midi_file) -> "Notes":
+		""" The notes of a miditoolkit MidiFile, in the same order read_smf keeps them """
+		rows = [(note.start, note.end, note.pitch, note.velocity, index)
+			for index, instrument in enumerate(midi_file.instruments) for note in instrument.notes]
+		start, end, pitch, velocity, instrument = zip(*rows) if rows else ([],) * 5
+		return cls(
+			start=np.array(start, dtype=np.int64),
+			end=np.array(end, dtype=np.int64),
+			pitch=np.array(pitch, dtype=np.uint8),
+			velocity=np.array(velocity, dtype=np.uint8),
+			instrument=np.array(instrument, dtype=np.int32),
+		)
+
+class SMF:
+	""" The notes, tempo and meter of a MIDI file, read by read_smf """
+
+	def __init__(self, ticks_per_beat: int, notes: Notes, instruments: list[Instrument],
+			tempo_changes: list[TempoChange], time_signature_changes: list[TimeSignature]):
+		self.ticks_per_beat = ticks_per_beat
+		self.notes = notes
+		self.instruments = instruments
+		self.tempo_changes = tempo_changes
+		self.time_signature_changes = time_signature_changes
+
+	@property
+	def num_instruments(self) -> int:
+		return len(self.instruments)
+
+	def instrument_groups(self) -> dict[str, list[int]]:
+		""" Indexes into self.instruments of every instrument, the drums, the rest, and each track's
+		instruments (as track_<n>), by group name. Groups without instruments are left out. """
+		groups = {
+			"all": list(range(self.num_instruments)),
+			"drums": [i for i, instrument in enumerate(self.instruments) if instrument.is_drum],
+			"non_drums": [i for i, instrument in enumerate(self.instruments) if not instrument.is_drum],
+		}
+		for i, instrument in enumerate(self.instruments):
+			groups.setdefault(f"track_{instrument.track}", []).append(i)
+		return {name: instruments for name, instruments in groups.items() if instruments}
+
+	@cached_property
+	def meter_map(self) -> MeterMap:
+		return MeterMap(self.time_signature_changes, self.ticks_per_beat)
+
+	@cached_property
+	def tempo_map(self) -> TempoMap:
+		return TempoMap(self.tempo_changes)
+
+	@cached_property
+	def sorted_notes(self) -> Notes:
+		""" self.notes by start tick, sorted once and shared by everything that segments the file """
+		return self.notes.sorted()
+
+def read_smf(source: Union[bytes, bytearray, memoryview, str, Path]) -> SMF:
+	""" Read a MIDI file from its bytes, or from a path """
+	if isinstance(source, (str, Path)):
+		source = Path(source).read_bytes()
+	data = source.cast("B") if isinstance(source, memoryview) else source
+
+	if bytes(data[:4]) != b"MThd":
+		raise SMFError("MThd not found. Probably not a MIDI file")
+	header_size, = struct.unpack_from(">L", data, 4)
+	if header_size < 6 or len(data) < 8 + header_size:
+		raise SMFError("truncated header")
+	_, track_count, ticks_per_beat = struct.unpack_from(">hhh", data, 8)
+
+	reader = _Reader()
+	pos = 8 + header_size
+	for track in range(track_count):
+		if len(data) < pos + 8:
+			raise SMFError(f"missing track {track}")
+		name, size = struct.unpack_from(">4sL", data, pos)
+		if name != b"MTrk":
+			raise SMFError("no MTrk header at start of track")
+		pos += 8
+		if len(data) < pos + size:
+			raise SMFError(f"track {track} is truncated")
+		reader.read_track(data, pos, pos + size, track)
+		pos += size
+	return reader.smf(ticks_per_beat)
+
+class _Reader:
+	""" Accumulates the events read_smf keeps, across tracks """
+
+	def __init__(self):
+		self.start, self.end, self.pitch, self.velocity, self.instrument = [], [], [], [], []
+		self.instruments: dict[tuple[int, int, int], int] = {} # (program, channel, track) -> index, in order of first note
+		self.tempos: list[TempoChange] = [TempoChange(DEFAULT_BPM, 0)]
+		self.timesigs: list[TimeSignature] = []
+
+	def read_track(self, data, pos: int, end: int, track: int):
+		tick = 0
+		running = None
+		programs = [0] * 16
+		open_notes: dict[int, list[tuple[int, int]]] = {} # (channel << 7 | pitch) -> [(start, velocity)], oldest first
+		try:
+			while pos < end:
+				byte = data[pos]
+				pos += 1
+				delta = byte & 0x7F
+				while byte & 0x80:
+					byte = data[pos]
+					pos += 1
+					delta = (delta << 7) | (byte & 0x7F)
+				tick += delta
+
+				status = data[pos]
+				if status & 0x80:
+					pos += 1
+					if status != 0xFF: # meta events don't set running status
+						running = status
+				elif running is None:
+					raise SMFError("running status without last_status")
+				else:
+					status = running
+
+				kind = status & 0xF0
+				if kind == 0x90 or kind == 0x80:
+					pitch = data[pos]
+					velocity = data[pos + 1]
+					pos += 2
+					if (pitch | velocity) & 0x80:
+						raise SMFError("data byte must be in range 0..127")
+					key = (status & 0x0F) << 7 | pitch
+					if kind == 0x90 and velocity:
+						open_notes.setdefault(key, []).append((tick, velocity))
+					elif key in open_notes:
+						# one note-off closes the oldest open note of its pitch, like miditoolkit
+						queued = open_notes[key]
+						start, velocity = queued.pop(0)
+						if not queued:
+							del open_notes[key]
+						channel = status & 0x0F
+						self.add_note(start, tick, pitch, velocity, (programs[channel], channel, track))
+				elif kind == 0xC0:
+					program = data[pos]
+					pos += 1
+					if program & 0x80:
+						raise SMFError("data byte must be in range 0..127")
+					programs[status & 0x0F] = program
+				elif kind != 0xF0:
+					if CHANNEL_DATA_LENGTHS[kind] == 2:
+						checked = data[pos] | data[pos + 1]
+						pos += 2
+					else:
+						checked = data[pos]
+						pos += 1
+					if checked & 0x80:
+						raise SMFError("data byte must be in range 0..127")
+				elif status == 0xFF:
+					meta_type = data[pos]
+					length, pos = _read_varint(data, pos + 1)
+					self.add_meta(meta_type, data[pos:pos + length], tick)
+					pos += length
+				elif status == 0xF0 or status == 0xF7:
+					length, pos = _read_varint(data, pos)
+					pos += length
+				elif status in SYSTEM_DATA_LENGTHS:
+					pos += SYSTEM_DATA_LENGTHS[status]
+				else:
+					raise SMFError(f"undefined status byte 0x{status:02x}")
+		except IndexError:
+			raise SMFError(f"track {track} ends in the middle of an event") from None
+		if pos > end:
+			raise SMFError(f"track {track} ends in the middle of an event")
+
+	def add_note(self, start: int, end: int, pitch: int, velocity: int, instrument: tuple[int, int, int]):
+		index = self.instruments.setdefault(instrument, len(self.instruments))
+		self.start.append(start)
+		self.end.append(end)
+		self.pitch.append(pitch)
+		self.velocity.append(velocity)
+		self.instrument.append(index)
+
+	def add_meta(self, meta_type: int, payload, tick: int):
+		if meta_type == 0x51 and len(payload) >= 3:
+			tempo = (payload[0] << 16) | (payload[1] << 8) | payload[2]
+			if tempo == 0:
+				return
+			bpm = 60_000_000 / tempo
+			# same bookkeeping as miditoolkit: a tick 0 tempo replaces everything so far, repeats are dropped
+			if tick == 0:
+				self.tempos = [TempoChange(bpm, 0)]
+			elif bpm != self.tempos[-1].tempo:
+				self.tempos.append(TempoChange(bpm, tick))
+		elif meta_type == 0x58 and len(payload) >= 2:
+			self.timesigs.append(TimeSignature(payload[0], 2 ** payload[1], tick))
+
+	def smf(self, ticks_per_beat: int) -> SMF:
+		notes = Notes(
+			start=np.array(self.start, dtype=np.int64),
+			end=np.array(self.end, dtype=np.int64),
+			pitch=np.array(self.pitch, dtype=np.uint8),
+			velocity=np.array(self.velocity, dtype=np.uint8),
+			instrument=np.array(self.instrument, dtype=np.int32),
+		)
+		self.timesigs.sort(key=lambda ts: ts.time)
+		instruments = [Instrument(*key) for key in self.instruments]
+		return SMF(ticks_per_beat, notes, instruments, self.tempos, self.timesigs)
+
+def _read_varint(data, pos: int) -> tuple[int, int]:
+	""" A variable-length quantity starting at pos, and the position after it """
+	value = 0
+	while True:
+		byte = data[pos]
+		pos += 1
+		value = (value << 7) | (byte & 0x7F)
+		if byte < 0x80:
+			return value, pos
@@ -5,20 +5,37 @@ Institution: Centre for Digital Music, Queen Mary University of London
 '''
 from .rhythm_parser import *
 from .music_objects import *
-from miditoolkit import MidiFile
+from .smf import SMF, read_smf
 
 
 def sync_perbar_permodel (model, bar, parameters=None):
         return model.get_syncopation(bar, parameters)
 
+def midi_statistics(smf):
+        """ instrument and track counts of a parsed MIDI file, as they are added to calculate_syncopation's output """
+        return {
+                "instruments": smf.num_instruments,
+                "drum_instruments": sum(instrument.is_drum for instrument in smf.instruments),
+                "tracks": len({instrument.track for instrument in smf.instruments}),
+                "notes": len(smf.notes),
+        }
+
 def calculate_syncopation(model, source, parameters=None, outfile=None, barRange=None):
+        """ source is a BarList, a Bar, an already parsed MIDI file (SMF) or the name of a .mid or .rhy file.
+            For MIDI files the output also has the midi_statistics of the file. """
         total = 0.0
         barResults = []
         numberOfNotes = 0
 
         barlist = None
-
-        if isinstance(source, BarList):
+        statistics = {}
+
+        if isinstance(source, SMF):
+                from . import readmidi
+                barlist = readmidi.get_bars_from_midi(source)
+                statistics = midi_statistics(source)
+                sourceType = "midi file"
+        elif isinstance(source, BarList):
                 barlist = source
                 sourceType = "bar list"
         elif isinstance(source, Bar):
@@ -30,9 +47,10 @@ def calculate_syncopation(model, source, parameters=None, outfile=None, barRange
                 #treat source as a filename
                 sourceType = source
                 if source[-4:]==".mid":
-                        import readmidi
-                        midiFile = MidiFile(source)
-                        barlist = readmidi.get_bars_from_midi(midiFile)
+                        from . import readmidi
+                        smf = read_smf(source)
+                        barlist = readmidi.get_bars_from_midi(smf)
+                        statistics = midi_statistics(smf)
 
                 elif source[-4:]==".rhy":
                         #import rhythm_parser
@@ -79,7 +97,7 @@ def calculate_syncopation(model, source, parameters=None, outfile=None, barRange
                                 discardedlist.append(barlist.index(bar))
                                 print('Model could not measure bar %d, returning None.' % (barlist.index(bar)+1))
 
-                import WNBD
+                from . import WNBD
                 if model is WNBD:
                         total =  total / numberOfNotes
 
@@ -92,7 +110,8 @@ def calculate_syncopation(model, source, parameters=None, outfile=None, barRange
                         "number_of_bars_not_measured":barsDiscarded, 
                         "bars_with_valid_output":includedlist, 
                         "bars_without_valid_output":discardedlist, 
-                        "syncopation_by_bar":barResults
+                        "syncopation_by_bar":barResults,
+                        **statistics
                         }
 
         if outfile!=None:
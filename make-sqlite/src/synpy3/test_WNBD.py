@@ -1,7 +1,7 @@
 import os
 
-import WNBD
-from syncopation import calculate_syncopation
+from . import WNBD
+from .syncopation import calculate_syncopation
 from miditoolkit import MidiFile
 
 """ These midi files represent the scores used as examples in the original paper.
@@ -20,10 +20,12 @@ WNBD_answers = {
 }
 
 
+TEST_MIDI_DIR = os.path.join(os.path.dirname(__file__), "test_midis", "wnbd")
+
 def test_WNBD():
-    for file in os.listdir("test_midis/wnbd"):
+    for file in os.listdir(TEST_MIDI_DIR):
         if file[-3:] == "mid":
-            in_path = os.path.join("test_midis/wnbd", file)
+            in_path = os.path.join(TEST_MIDI_DIR, file)
             out_path = in_path[:-3] + "xml"
             assert calculate_syncopation(WNBD, source=in_path, outfile=out_path)["summed_syncopation"] == WNBD_answers[file]
 
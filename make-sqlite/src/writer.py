@@ -0,0 +1,119 @@
+""" Batched single-writer for loading rows into the SQLite database.
+
+    Rows are buffered per (table, columns, conflict handling) and written with one
+    executemany per BATCH_SIZE rows. The SQL for each buffer is built once, so
+    sqlite3's statement cache keeps reusing the same prepared statement.
+"""
+import sqlite3
+from functools import lru_cache
+from typing import Any, Iterable, Optional
+
+from ._utils import BATCH_SIZE, COMMIT_EVERY
+from .metrics import Metrics
+
+# load-time settings: WAL + synchronous=normal is still safe against a crash of this process
+LOAD_PRAGMAS: dict[str, Any] = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -256 * 1024, # negative means KiB, so 256 MiB
+    "temp_store": "memory",
+}
+
+@lru_cache(maxsize=None)
+def insert_sql(table_name: str, cols: tuple[str, ...], integrity_handler: str = "raise") -> str:
+    """Build the insert statement for a table once per column set."""
+    assert integrity_handler in ("ignore", "raise", "warn")
+    col_sql = ", ".join(map(lambda x: f'"{x}"', cols))
+    qs_sql = ", ".join(["?"] * len(cols))
+    sql = f'insert into "{table_name}" ({col_sql}) values ({qs_sql})'
+    if integrity_handler == "ignore":
+        sql += " on conflict do nothing"
+    return sql
+
+class BatchWriter:
+    """ Owns all writes to a connection during a load. Use as a context manager: entering
+        applies LOAD_PRAGMAS, leaving normally flushes and commits, and leaving with an
+        exception rolls back the uncommitted batch. Either way the previous PRAGMA values
+        are restored."""
+
+    def __init__(
+            self,
+            db: sqlite3.Connection,
+            batch_size: int = BATCH_SIZE,
+            commit_every: int = COMMIT_EVERY,
+            metrics: Optional[Metrics] = None,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.commit_every = commit_every
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.rows_written = 0
+        self._buffers: dict[tuple[str, tuple[str, ...], str], list[tuple[Any]]] = {}
+        self._uncommitted = 0
+        self._saved_pragmas: dict[str, Any] = {}
+
+    def __enter__(self) -> "BatchWriter":
+        for pragma, value in LOAD_PRAGMAS.items():
+            self._saved_pragmas[pragma] = self.db.execute(f"pragma {pragma}").fetchone()[0]
+            self.db.execute(f"pragma {pragma} = {value}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self._buffers.clear()
+            self.db.rollback()
+        for pragma, value in self._saved_pragmas.items():
+            self.db.execute(f"pragma {pragma} = {value}")
+        self._saved_pragmas.clear()
+
+    def add(
+            self,
+            table_name: str,
+            cols: list[str],
+            vals: Iterable[tuple[Any]],
+            integrity_handler: str = "raise",
+    ):
+        """Queue rows for a table. Same arguments as make_sqlite.insert_many."""
+        key = (table_name, tuple(cols), integrity_handler)
+        buffer = self._buffers.setdefault(key, [])
+        added = 0
+        for row in vals:
+            assert len(row) == len(cols)
+            buffer.append(row)
+            added += 1
+        if len(buffer) >= self.batch_size:
+            self._flush(key)
+        self._uncommitted += added
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+
+    def flush(self):
+        """Write every buffered row without committing."""
+        for key in list(self._buffers):
+            self._flush(key)
+
+    def commit(self):
+        """Flush every buffer and commit, making all rows added so far durable together."""
+        self.flush()
+        with self.metrics.time("commit"):
+            self.db.commit()
+        self._uncommitted = 0
+
+    def _flush(self, key: tuple[str, tuple[str, ...], str]):
+        rows = self._buffers.get(key)
+        if not rows:
+            return
+        table_name, cols, integrity_handler = key
+        try:
+            with self.metrics.time("insert"):
+                self.db.executemany(insert_sql(table_name, cols, integrity_handler), rows)
+        except sqlite3.IntegrityError:
+            if integrity_handler == "warn":
+                print(f"Warning: Integrity error ignored on {table_name}.")
+            else:
+                raise
+        self.rows_written += len(rows)
+        self.metrics.inc("rows_written", len(rows))
+        rows.clear()
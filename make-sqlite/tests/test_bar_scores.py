@@ -0,0 +1,49 @@
+import sqlite3
+
+import numpy as np
+
+from src import bar_scores
+from src.bar_scores import decode_bars, encode_bars, read_bar_scores
+from src.models import ModelScore
+
+OUTPUT = {
+    "summed_syncopation": 7.5,
+    "mean_syncopation_per_bar": 3.75,
+    "number_of_bars": 3,
+    "number_of_bars_not_measured": 1,
+    "syncopation_by_bar": [6.0, None, 1.5],
+}
+
+def test_round_trip_is_a_view():
+    values, mask = encode_bars(OUTPUT["syncopation_by_bar"])
+    assert len(values) == 3 * 4 and len(mask) == 1
+    bars = decode_bars(values, mask)
+    # frombuffer over immutable bytes: a read-only view, not a copy
+    assert not bars.data.flags.writeable and not bars.data.flags.owndata
+    assert bars.tolist() == [6.0, None, 1.5]
+    assert bars.sum() == 7.5
+
+def test_read_from_midi_model_scores(monkeypatch):
+    db = sqlite3.connect(":memory:")
+    db.execute("""
+        create table midi_model_scores (
+            md5, model, summed_syncopation, mean_syncopation_per_bar, number_of_bars,
+            number_of_bars_not_measured, syncopation_by_bar, bars_measured
+        )
+    """)
+    rows = [ModelScore.from_output(md5, model, OUTPUT) for md5 in ("a" * 32, "b" * 32) for model in ("WNBD", "LHL")]
+    db.executemany("insert into midi_model_scores values (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    everything = dict(read_bar_scores(db, "LHL"))
+    assert sorted(everything) == ["a" * 32, "b" * 32]
+    assert np.ma.allequal(everything["a" * 32], decode_bars(*encode_bars(OUTPUT["syncopation_by_bar"])))
+    assert [md5 for md5, _ in read_bar_scores(db, "WNBD", md5s=["b" * 32, "c" * 32])] == ["b" * 32]
+
+    # md5s are looked up a chunk at a time, not one query each
+    monkeypatch.setattr(bar_scores, "SQL_VARIABLES", 2)
+    statements = []
+    db.set_trace_callback(statements.append)
+    found = dict(read_bar_scores(db, "WNBD", md5s=["a" * 32, "c" * 32, "b" * 32]))
+    assert sorted(found) == ["a" * 32, "b" * 32]
+    assert len(statements) == 2
+
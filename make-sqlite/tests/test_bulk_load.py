@@ -0,0 +1,23 @@
+import sqlite3
+
+from src.bulk_load import build_indexes, drop_indexes
+
+def indexes(db: sqlite3.Connection) -> list[tuple[str, str]]:
+    return db.execute("select name, sql from sqlite_master where type = 'index' and sql is not null order by name").fetchall()
+
+def test_indexes_come_back_as_they_were_even_after_an_interrupted_load():
+    db = sqlite3.connect(":memory:")
+    db.execute("create table midi_files (md5 varchar primary key, tracks integer)")
+    db.execute("create index idx_midi on midi_files (md5)")
+    db.execute("create index idx_tracks on midi_files (tracks) where tracks > 1") # not known to any list
+    before = indexes(db)
+
+    drop_indexes(db)
+    assert indexes(db) == []
+    drop_indexes(db) # the load was interrupted and started over
+    build_indexes(db)
+
+    assert indexes(db) == before
+    assert db.execute("select name from sqlite_master where name = 'dropped_indexes'").fetchone() is None
+    build_indexes(db) # nothing left to build
+    assert indexes(db) == before
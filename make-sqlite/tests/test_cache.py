@@ -0,0 +1,78 @@
+from types import ModuleType
+
+from src import cache
+from src.cache import ScoreCache, TrackCache
+
+WNBD = ModuleType("synpy3.WNBD")
+LHL = ModuleType("LHL")
+MD5 = "0123456789abcdef0123456789abcdef"
+OUTPUT = {
+    "model_name": "WNBD",
+    "summed_syncopation": 0.8571428571428571,
+    "syncopation_by_bar": [6.0, 0],
+    "bars_with_valid_output": [0, 1],
+}
+
+def test_round_trip(tmp_path):
+    with ScoreCache(tmp_path / "scores.sqlite3") as scores:
+        assert scores.get(MD5, WNBD) is None
+        scores.put(MD5, WNBD, OUTPUT)
+    with ScoreCache(tmp_path / "scores.sqlite3") as scores:
+        assert scores.get(MD5, WNBD) == OUTPUT
+
+def test_key_covers_model_and_parameters(tmp_path):
+    with ScoreCache(tmp_path / "scores.sqlite3") as scores:
+        scores.put(MD5, WNBD, OUTPUT)
+        assert scores.get(MD5, LHL) is None
+        assert scores.get(MD5, WNBD, parameters={"Lmax": 5}) is None
+        assert scores.get(MD5, WNBD, parameters={}) == OUTPUT
+
+def test_code_change_invalidates(tmp_path, monkeypatch):
+    with ScoreCache(tmp_path / "scores.sqlite3") as scores:
+        scores.put(MD5, WNBD, OUTPUT)
+        monkeypatch.setattr(cache, "synpy3_fingerprint", lambda: "edited")
+        assert scores.get(MD5, WNBD) is None
+
+def test_format_change_invalidates(tmp_path, monkeypatch):
+    with ScoreCache(tmp_path / "scores.sqlite3") as scores:
+        scores.put(MD5, WNBD, OUTPUT)
+        monkeypatch.setattr(cache, "SCORE_FORMAT", cache.SCORE_FORMAT + 1)
+        assert scores.get(MD5, WNBD) is None
+
+def test_fingerprint_covers_modules_but_not_tests(tmp_path, monkeypatch):
+    (tmp_path / "WNBD.py").write_text("x = 1")
+    (tmp_path / "TimeSignature.pkl").write_bytes(b"table")
+    monkeypatch.setattr(cache, "SYNPY3_PATH", tmp_path)
+    def fingerprint():
+        cache.synpy3_fingerprint.cache_clear()
+        return cache.synpy3_fingerprint()
+    try:
+        before = fingerprint()
+        (tmp_path / "test_WNBD.py").write_text("assert True")
+        assert fingerprint() == before
+        (tmp_path / "WNBD.py").write_text("x = 2")
+        assert fingerprint() != before
+    finally:
+        cache.synpy3_fingerprint.cache_clear() # not this directory's fingerprint for the other tests
+
+def test_puts_committed_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "COMMIT_EVERY", 2)
+    with ScoreCache(tmp_path / "scores.sqlite3") as scores:
+        reader = ScoreCache(tmp_path / "scores.sqlite3")
+        scores.put(MD5, WNBD, OUTPUT)
+        assert reader.get(MD5, WNBD) is None
+        scores.put(MD5, LHL, OUTPUT)
+        assert reader.get(MD5, WNBD) == OUTPUT
+        reader.close()
+
+TRACK = {"id": "A" * 22, "name": "song", "available_markets": ["US"], "album": {"id": "album", "available_markets": ["US"]}}
+
+def test_tracks_cached_with_misses_and_ttl(tmp_path, monkeypatch):
+    with TrackCache(tmp_path / "tracks.sqlite3", ttl=60) as tracks:
+        tracks.put_many(["A" * 22, "B" * 22], [TRACK, None])
+    with TrackCache(tmp_path / "tracks.sqlite3", ttl=60) as tracks:
+        hits = tracks.get_many(["A" * 22, "B" * 22, "C" * 22])
+        assert hits == {"A" * 22: {"id": "A" * 22, "name": "song", "album": {"id": "album"}}, "B" * 22: None}
+        now = cache.time.time()
+        monkeypatch.setattr(cache.time, "time", lambda: now + 61)
+        assert tracks.get_many(["A" * 22, "B" * 22]) == {}
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from src.features import FEATURE_COLUMNS, FeatureStore
+
+CSV = "id,name,danceability,acousticness,energy,valence,speechiness,instrumentalness,year\n" + "\n".join([
+    "AAAAAAAAAAAAAAAAAAAAAA,one,0.5,0.1,0.2,0.3,0.4,0.6,1999",
+    "BBBBBBBBBBBBBBBBBBBBBB,two,0.25,0,1,0,0,0,2001",
+    "CCCCCCCCCCCCCCCCCCCCCC,three,1,1,1,1,1,1,2010",
+])
+
+def test_restricted_to_sids(tmp_path):
+    path = tmp_path / "tracks_features.csv"
+    path.write_text(CSV)
+    store = FeatureStore.from_csv(path, sids=["BBBBBBBBBBBBBBBBBBBBBB", "ZZZZZZZZZZZZZZZZZZZZZZ"])
+    assert len(store) == 1
+    assert "AAAAAAAAAAAAAAAAAAAAAA" not in store
+    assert store.get("ZZZZZZZZZZZZZZZZZZZZZZ") is None
+    row = store.get("BBBBBBBBBBBBBBBBBBBBBB")
+    assert row.dtype == np.float32
+    assert dict(zip(FEATURE_COLUMNS, row.tolist()))["danceability"] == 0.25
+
+def test_snapshot_reused_until_stale(tmp_path):
+    path = tmp_path / "tracks_features.csv"
+    path.write_text(CSV)
+    snapshot = tmp_path / "features"
+    sids = ["AAAAAAAAAAAAAAAAAAAAAA", "CCCCCCCCCCCCCCCCCCCCCC"]
+
+    built = FeatureStore.open(path, sids, snapshot_path=snapshot)
+    loaded = FeatureStore.open(path, sids, snapshot_path=snapshot)
+    assert isinstance(loaded.values, np.memmap)
+    assert np.array_equal(built.values, loaded.values)
+
+    rebuilt = FeatureStore.open(path, sids[:1], snapshot_path=snapshot)
+    assert not isinstance(rebuilt.values, np.memmap)
+    assert len(rebuilt) == 1
+
+def test_interrupted_save_keeps_the_previous_snapshot(tmp_path, monkeypatch):
+    path = tmp_path / "tracks_features.csv"
+    path.write_text(CSV)
+    snapshot = tmp_path / "features"
+    sids = ["AAAAAAAAAAAAAAAAAAAAAA", "CCCCCCCCCCCCCCCCCCCCCC"]
+    FeatureStore.open(path, sids, snapshot_path=snapshot)
+
+    saved, save = [], np.save
+    def crash_after_ids(file, array):
+        if saved:
+            raise KeyboardInterrupt
+        saved.append(file)
+        save(file, array)
+    monkeypatch.setattr(np, "save", crash_after_ids)
+    with pytest.raises(KeyboardInterrupt):
+        FeatureStore.open(path, sids[:1], snapshot_path=snapshot)
+    monkeypatch.undo()
+
+    assert [child.name for child in tmp_path.iterdir() if child.name.startswith("features")] == ["features"]
+    loaded = FeatureStore.open(path, sids, snapshot_path=snapshot)
+    assert isinstance(loaded.values, np.memmap) and loaded.ids.tolist() == sids
+
+def test_ids_are_read_as_strings(tmp_path):
+    path = tmp_path / "tracks_features.csv"
+    path.write_text("id,danceability,acousticness,energy,valence,speechiness,instrumentalness\n1234,0,0,0,0,0,0\n")
+    assert FeatureStore.from_csv(path).ids.tolist() == ["1234"]
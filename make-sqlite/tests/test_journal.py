@@ -0,0 +1,87 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from src.journal import ProgressJournal
+from src.make_sqlite import insert_loaded_links, insert_manifest
+from src.manifest import Manifest, ManifestEntry
+from src.models import LinkIndex
+from src.shard import Shard
+from src.writer import BatchWriter
+from tests.test_shard import create_tables
+
+def test_pending_skips_journaled_and_loaded_ids(tmp_path):
+    db = sqlite3.connect(tmp_path / "data.sqlite3")
+    db.execute("create table midi_files (md5 varchar primary key)")
+    # loaded by a run that predates the journal
+    db.execute("insert into midi_files values ('loaded')")
+    db.commit()
+
+    with BatchWriter(db) as writer:
+        journal = ProgressJournal(writer)
+        journal.mark("midi", ["journaled"])
+        journal.mark("spotify", ["new"])
+        journal.commit()
+        assert journal.pending("midi", ["new", "loaded", "journaled", "newer"]) == ["new", "newer"]
+        # the temp table does not outlive the query
+        assert journal.pending("midi", []) == []
+
+def test_crashed_run_resumes_after_its_last_committed_batch(tmp_path):
+    db = sqlite3.connect(tmp_path / "data.sqlite3")
+    db.execute("create table spotify_tracks (spotify_id varchar primary key)")
+    db.commit()
+    sids = [f"{i:022d}" for i in range(10)]
+
+    with pytest.raises(KeyboardInterrupt):
+        with BatchWriter(db, commit_every=4) as writer:
+            journal = ProgressJournal(writer)
+            for sid in sids[:7]:
+                writer.add(table_name="spotify_tracks", cols=["spotify_id"], vals=[(sid,)])
+                journal.mark("spotify", [sid])
+            raise KeyboardInterrupt
+
+    # a row and its journal entry are 2 of every 4 rows per commit, so sids 0-5 were committed
+    # together with their entries, and only sid 6 was lost
+    with BatchWriter(db) as writer:
+        journal = ProgressJournal(writer)
+        assert journal.pending("spotify", sids) == sids[6:]
+        assert db.execute("select count(*) from load_journal").fetchone()[0] == 6
+        assert db.execute("select count(*) from spotify_tracks").fetchone()[0] == 6
+
+def test_start_of_run_syncs_only_new_links_and_changed_manifest_entries(tmp_path):
+    create_tables(tmp_path / "data.sqlite3")
+    db = sqlite3.connect(tmp_path / "data.sqlite3")
+    loaded, pending = "a" * 32, "b" * 32
+    old, new = "A" * 22, "B" * 22
+    db.execute("insert into midi_files (md5, instruments, drum_instruments, tracks) values (?, 1, 0, 1)", (loaded,))
+    db.execute("insert into midi_spotify_map values (?, ?, 0.5)", (loaded, old))
+    db.commit()
+
+    with BatchWriter(db) as writer:
+        first = Manifest(tmp_path, [
+            ManifestEntry(loaded, "a.mid", 10, 1.0),
+            ManifestEntry(pending, "b.mid", 20, 1.0),
+            ManifestEntry("c" * 32, "c.mid", 30, 1.0),
+        ])
+        insert_manifest(writer, first, Shard())
+        # b changed, c is gone, d is new, a is left alone
+        second = Manifest(tmp_path, [
+            ManifestEntry(loaded, "a.mid", 10, 1.0),
+            ManifestEntry(pending, "b.mid", 25, 2.0),
+            ManifestEntry("d" * 32, "d.mid", 40, 1.0),
+        ])
+        before = db.total_changes
+        insert_manifest(writer, second, Shard())
+        # three rows into the temp table, then one delete, one update and one insert
+        assert db.total_changes - before == 6
+        assert sorted(db.execute("select * from midi_manifest")) == sorted(second.entries.values())
+
+        links = LinkIndex(pd.DataFrame({
+            "md5": [loaded, loaded, loaded, pending],
+            "sid": [old, new, new, new],
+            "score": [0.5, 0.7, 0.7, 0.7],
+        }))
+        insert_loaded_links(writer, links, Shard())
+        # the pending file links itself when it is loaded
+        assert sorted(db.execute("select md5, spotify_id from midi_spotify_map")) == [(loaded, old), (loaded, new)]
@@ -0,0 +1,27 @@
+from pathlib import Path
+
+from src._utils import midi_path
+from src.manifest import Manifest
+
+SMALL = "0" * 32
+BIG = "f" * 32
+EMPTY = "a" * 32
+MISSING = "b" * 32
+
+def test_scan_and_check(tmp_path):
+    for md5, size in ((SMALL, 10), (BIG, 1000), (EMPTY, 0)):
+        path = midi_path(tmp_path, md5)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+    tmp_path.joinpath("0", "notes.txt").write_text("not a MIDI file")
+
+    manifest = Manifest.scan(tmp_path, threads=4)
+    assert len(manifest) == 3
+    assert manifest.entries[BIG].path == str(Path("f", "f", "f", BIG + ".mid"))
+    assert manifest.entries[BIG].size == 1000
+    assert manifest.path(SMALL) == midi_path(tmp_path, SMALL)
+
+    present, missing, unreadable = manifest.check([SMALL, MISSING, EMPTY, BIG])
+    assert present == [BIG, SMALL]
+    assert missing == [MISSING]
+    assert unreadable == [EMPTY]
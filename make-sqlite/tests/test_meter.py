@@ -0,0 +1,36 @@
+from itertools import islice
+
+import numpy as np
+import pytest
+from miditoolkit import TempoChange, TimeSignature
+
+from src.synpy3.meter import MeterMap, TempoMap
+
+TICKS_PER_BEAT = 96 # a 4/4 bar is 384 ticks, 3/4 and 6/8 bars are 288
+
+def meter_map() -> MeterMap:
+    return MeterMap([TimeSignature(4, 4, 0), TimeSignature(3, 4, 768), TimeSignature(6, 8, 1000)], TICKS_PER_BEAT)
+
+def test_lookup_takes_the_last_change_at_or_before_the_tick():
+    meters = meter_map()
+    assert [meters.meter(tick) for tick in (0, 767, 768, 999, 1000, 10**9)] == [(4, 4), (4, 4), (3, 4), (3, 4), (6, 8), (6, 8)]
+    assert meters.indexes(np.array([0, 767, 768, 1000])).tolist() == [0, 0, 1, 2]
+    # before the first change, the first one applies
+    assert MeterMap([TimeSignature(3, 4, 100), TimeSignature(4, 4, 500)], TICKS_PER_BEAT).meter(0) == (3, 4)
+
+    # unsorted changes, as tempo changes from several tracks come
+    tempos = TempoMap([TempoChange(120, 0), TempoChange(90, 960), TempoChange(100, 480)])
+    assert [tempos.tempo(tick) for tick in (0, 479, 480, 959, 960)] == [120, 120, 100, 100, 90]
+
+def test_bars_change_meter_at_the_next_bar_line():
+    meters = meter_map()
+    starts, lengths = meters.bars_until(1400)
+    # the 6/8 change at 1000 falls inside the 3/4 bar from 768, so it starts at 1056
+    assert starts.tolist() == [0, 384, 768, 1056, 1344]
+    assert lengths.tolist() == [384, 384, 288, 288, 288]
+    assert list(islice(meters.iter_bars(), 5)) == list(zip(starts.tolist(), lengths.tolist()))
+    assert meters.bars_until(0)[0].tolist() == [0]
+
+def test_needs_a_time_signature():
+    with pytest.raises(ValueError):
+        MeterMap([], TICKS_PER_BEAT)
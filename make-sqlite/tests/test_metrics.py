@@ -0,0 +1,47 @@
+import json
+
+from src.metrics import Metrics, MetricsReporter, timed
+
+def test_histograms_counters_and_gauges():
+    metrics = Metrics()
+    for seconds in (0.002, 0.002, 0.3, 2.0):
+        metrics.observe("fetch", seconds)
+    metrics.inc("rows_written", 10)
+    metrics.gauge("queue_depth", lambda: 3)
+
+    snapshot = metrics.snapshot()
+    fetch = snapshot["histograms"]["fetch"]
+    assert fetch["count"] == 4 and fetch["max"] == 2.0
+    assert fetch["p50"] == 0.005 and fetch["p99"] == 2.0
+    assert fetch["buckets"]["0.005"] == 2 and fetch["buckets"]["inf"] == 4
+    assert snapshot["counters"] == {"rows_written": 10}
+    assert snapshot["gauges"] == {"queue_depth": 3}
+    assert "fetch" in metrics.summary() and "rows_written" in metrics.summary()
+
+def test_worker_timings_observed():
+    timings = {}
+    with timed(timings, "parse"):
+        pass
+    with timed(None, "segment"):
+        pass
+    metrics = Metrics()
+    metrics.observe_all(timings)
+    assert set(metrics.histograms) == {"parse"}
+
+def test_reporter_sinks(tmp_path):
+    metrics = Metrics()
+    metrics.observe("insert", 0.01)
+    metrics.inc("rows_written", 5)
+    metrics.gauge("queue_depth", lambda: 2)
+    with MetricsReporter(metrics, tmp_path / "metrics.json", interval=60):
+        pass
+    with MetricsReporter(metrics, tmp_path / "metrics.prom", interval=60):
+        pass
+
+    assert json.loads((tmp_path / "metrics.json").read_text())["counters"]["rows_written"] == 5
+    prom = (tmp_path / "metrics.prom").read_text()
+    assert "# TYPE make_sqlite_rows_written_total counter\nmake_sqlite_rows_written_total 5" in prom
+    assert "# TYPE make_sqlite_queue_depth gauge\nmake_sqlite_queue_depth 2" in prom
+    assert "# TYPE make_sqlite_stage_seconds histogram" in prom
+    assert 'make_sqlite_stage_seconds_bucket{stage="insert",le="+Inf"} 1' in prom
+    assert 'make_sqlite_stage_seconds_count{stage="insert"} 1' in prom
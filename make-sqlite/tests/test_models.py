@@ -0,0 +1,52 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from src.make_sqlite import insert_rejected_matches
+from src.models import Link, LinkIndex, validate_matches
+from src.writer import BatchWriter
+from tests.test_shard import create_tables
+
+MD5 = "0123456789abcdef" * 2
+SID = "A" * 22
+
+MATCHES = pd.DataFrame([
+    (MD5, SID, "0.5", None),
+    ("g" * 32, SID, "0.5", "invalid md5"), # not hexadecimal
+    (MD5[:31], SID, "0.5", "invalid md5"),
+    (MD5 + "0", SID, "0.5", "invalid md5"),
+    (np.nan, SID, "0.5", "invalid md5"),
+    (MD5, SID[:21], "0.5", "invalid sid"),
+    (MD5, SID + "A", "0.5", "invalid sid"),
+    (MD5, SID, "high", "invalid score"),
+    (MD5, SID, "0", "invalid score"),
+    (MD5, SID, "1.5", "invalid score"),
+    # the first failing check gives the reason
+    ("g" * 32, SID[:21], "0", "invalid md5"),
+    (MD5, SID[:21], "high", "invalid sid"),
+], columns=["md5", "sid", "score", "reason"])
+
+def test_validate_matches():
+    valid, rejected = validate_matches(MATCHES)
+    assert Link.from_valid(valid) == [Link(MD5, SID, 0.5)]
+    assert rejected["reason"].tolist() == MATCHES["reason"][1:].tolist()
+    # kept as they were read
+    assert rejected["score"].tolist() == MATCHES["score"][1:].tolist()
+    assert rejected["md5"].isna().tolist() == MATCHES["md5"][1:].isna().tolist()
+
+def test_rejected_rows_are_kept_aside_and_stored(tmp_path):
+    links = LinkIndex(MATCHES)
+    assert links.for_md5(MD5) == [Link(MD5, SID, 0.5)] and links.for_sid(SID[:21]) == []
+    assert len(links.rejected) == len(MATCHES) - 1
+
+    create_tables(tmp_path / "data.sqlite3")
+    db = sqlite3.connect(tmp_path / "data.sqlite3")
+    with BatchWriter(db) as writer:
+        insert_rejected_matches(writer, links.rejected)
+        insert_rejected_matches(writer, links.rejected) # replaces, not appends
+    rows = db.execute("select md5, sid, score, reason from rejected_matches order by rowid").fetchall()
+    assert rows == [
+        (None if pd.isna(md5) else md5, sid, score, reason)
+        for md5, sid, score, reason in MATCHES[1:].itertuples(index=False)
+    ]
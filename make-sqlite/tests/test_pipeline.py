@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from src.pipeline import Pipeline
+
+def test_all_items_from_every_stage():
+    pipeline = Pipeline(maxsize=2)
+    pipeline.stage("letters", lambda: iter("abc"))
+    pipeline.stage("numbers", lambda: iter(range(100)))
+    results = list(pipeline.results())
+    assert [item for stage, item in results if stage == "letters"] == list("abc")
+    assert [item for stage, item in results if stage == "numbers"] == list(range(100))
+
+def test_queue_bounds_how_far_producers_run_ahead():
+    produced = []
+    def produce():
+        for i in range(50):
+            produced.append(i)
+            yield i
+
+    pipeline = Pipeline(maxsize=4)
+    pipeline.stage("numbers", produce)
+    results = pipeline.results()
+    for consumed in range(10):
+        assert next(results) == ("numbers", consumed)
+        # queued items, plus one being put and one being produced
+        assert len(produced) <= consumed + 1 + 4 + 2
+    results.close()
+    assert len(produced) < 50
+
+def test_stage_error_raised_and_other_stages_stopped():
+    closed = threading.Event()
+    def forever():
+        try:
+            while True:
+                yield 0
+        finally:
+            closed.set()
+    def broken():
+        yield 1
+        raise ValueError("bad file")
+
+    pipeline = Pipeline(maxsize=1)
+    pipeline.stage("forever", forever)
+    pipeline.stage("broken", broken)
+    with pytest.raises(ValueError, match="bad file"):
+        for _ in pipeline.results():
+            pass
+    assert closed.is_set()
@@ -0,0 +1,157 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.cache import ScoreCache
+from src.metrics import Metrics
+from src.models import MIDI, MODELS, LinkIndex
+from src.scoring import ScoringFailure, _init_worker, _overdue, _windowed, score_midis
+from src.synpy3.smf import SMF, read_smf
+from src.synpy3.syncopation import calculate_syncopation
+from tests.test_smf import write_midi
+
+TEST_MIDIS = sorted(Path(__file__).parent.parent.joinpath("src", "synpy3", "test_midis", "wnbd").glob("*.mid"))[:3]
+
+def started(path: Path) -> Path:
+    """Worker for the window test: leaves a mark for every task it starts."""
+    path.touch()
+    return path
+
+def stuck_or_crashed(path: Path) -> str:
+    """Worker for the watchdog test: hangs past any budget, or dies, depending on the file name."""
+    if path.name == "stuck":
+        time.sleep(60)
+    elif path.name == "crashed":
+        os._exit(1)
+    return path.name
+
+def links() -> LinkIndex:
+    return LinkIndex(pd.DataFrame({"md5": ["a" * 32], "sid": ["A" * 22], "score": [0.5]}))
+
+def test_one_pass_matches_one_model_at_a_time():
+    path = TEST_MIDIS[0]
+    together = MIDI.score(path, list(MODELS))
+    for name in MODELS:
+        assert MIDI.score(path, [name])[name] == together[name]
+
+def test_partially_cached_files_score_only_missing_models(tmp_path):
+    with ScoreCache(tmp_path / "scores.sqlite3") as cache:
+        wnbd_only = {midi.md5: midi for midi in score_midis(TEST_MIDIS, links(), procs=1, cache=cache)}
+        metrics = Metrics()
+        scored = list(score_midis(TEST_MIDIS, links(), procs=1, cache=cache, metrics=metrics, models=["LHL", "TOB"]))
+
+    # parsed once more for the new models, WNBD came from the cache
+    assert metrics.histograms["parse"].count == len(TEST_MIDIS)
+    assert set(metrics.histograms) == {"parse", "segment", "score_LHL", "score_TOB"}
+
+    assert len(scored) == len(TEST_MIDIS)
+    for midi in scored:
+        assert [score.model for score in midi.model_scores] == ["WNBD", "LHL", "TOB"]
+        assert midi.summed_WNBD == wnbd_only[midi.md5].summed_WNBD
+        assert midi.model_scores[0] == wnbd_only[midi.md5].model_scores[0]
+
+def test_failed_and_slow_files_are_recorded_and_the_run_continues(tmp_path):
+    broken = tmp_path / ("0" * 32 + ".mid")
+    broken.write_bytes(b"not a midi file")
+    metrics = Metrics()
+    results = list(score_midis([broken, *TEST_MIDIS], links(), procs=2, chunksize=1, metrics=metrics, recycle_after=1))
+
+    failures = [result for result in results if isinstance(result, ScoringFailure)]
+    assert [failure.md5 for failure in failures] == [broken.stem]
+    assert len(results) == len(TEST_MIDIS) + 1
+    assert metrics.counters["midi_files_failed"] == 1
+
+    slow = list(score_midis(TEST_MIDIS[:1], links(), procs=2, timeout=1e-4))
+    assert isinstance(slow[0], ScoringFailure) and "time budget" in slow[0].reason
+    # with one process, scored off the main thread as the pipeline does, the budget still applies
+    with ThreadPoolExecutor(1) as thread:
+        slow = thread.submit(lambda: list(score_midis(TEST_MIDIS[:1], links(), procs=1, timeout=1e-4))).result()
+    assert isinstance(slow[0], ScoringFailure) and "time budget" in slow[0].reason
+
+def test_parsed_file_scores_like_its_path():
+    smf = read_smf(TEST_MIDIS[0])
+    from_path, from_smf = MIDI.score(TEST_MIDIS[0]), MIDI.score(smf)
+    assert {**from_smf["WNBD"], "source": str(TEST_MIDIS[0])} == from_path["WNBD"]
+    assert from_smf["WNBD"]["instruments"] == 1 and from_smf["WNBD"]["tracks"] == 1
+    assert from_smf["WNBD"]["notes"] == len(smf.notes)
+
+    output = calculate_syncopation(MODELS["WNBD"], smf)
+    assert output["summed_syncopation"] == from_path["WNBD"]["summed_syncopation"]
+    assert output["drum_instruments"] == from_path["WNBD"]["drum_instruments"]
+
+def test_path_is_parsed_once_for_every_model(monkeypatch):
+    import src.models
+    import src.synpy3.syncopation
+    parsed = []
+    def counting_read_smf(path):
+        parsed.append(path)
+        return read_smf(path)
+    monkeypatch.setattr(src.models, "read_smf", counting_read_smf)
+    monkeypatch.setattr(src.synpy3.syncopation, "read_smf", counting_read_smf)
+    MIDI.score(TEST_MIDIS[0], list(MODELS), groups=True)
+    assert parsed == [TEST_MIDIS[0]]
+
+def test_instrument_groups_are_scored_on_the_bars_of_the_whole_file(tmp_path):
+    path = tmp_path / ("b" * 32 + ".mid")
+    write_midi(path)
+    smf = read_smf(path)
+    scores = MIDI.score(smf, ["WNBD", "KTH"], groups=True)
+
+    groups = scores["WNBD"]["groups"]
+    assert list(groups) == ["all", "drums", "non_drums", "track_1", "track_2"]
+    assert groups["drums"]["notes"] + groups["non_drums"]["notes"] == groups["all"]["notes"] == len(smf.notes)
+    assert {output["number_of_bars"] for output in groups.values()} == {scores["WNBD"]["number_of_bars"]}
+    assert groups["all"]["syncopation_by_bar"] == scores["WNBD"]["syncopation_by_bar"]
+
+    # a group scores like a file with only its notes, up to where that file ends
+    drums = np.isin(smf.notes.instrument, smf.instrument_groups()["drums"])
+    alone = SMF(smf.ticks_per_beat, smf.notes.select(drums), smf.instruments, smf.tempo_changes, smf.time_signature_changes)
+    by_bar = calculate_syncopation(MODELS["KTH"], alone)["syncopation_by_bar"]
+    assert scores["KTH"]["groups"]["drums"]["syncopation_by_bar"][:len(by_bar)] == by_bar
+
+    midi = MIDI.from_scores(path.stem, scores, [])
+    assert len(midi.instrument_scores) == 2 * len(groups)
+
+    # cached apart from the plain scores
+    with ScoreCache(tmp_path / "scores.sqlite3") as cache:
+        plain, = score_midis([path], links(), procs=1, cache=cache)
+        grouped, = score_midis([path], links(), procs=1, cache=cache, groups=True)
+        again, = score_midis([path], links(), procs=1, cache=cache, groups=True)
+    assert plain.instrument_scores == [] and len(grouped.instrument_scores) == len(groups)
+    assert again.instrument_scores == grouped.instrument_scores
+
+def test_pool_holds_at_most_a_window_of_files_for_a_slow_caller(tmp_path):
+    window = 4
+    with get_context().Pool(2) as pool:
+        results = _windowed(pool, started, [tmp_path / f"{i}.started" for i in range(30)], window)
+        for consumed, _ in enumerate(results):
+            time.sleep(0.02)
+            # handed over: the first window, and one more for every result taken before this one
+            assert len(list(tmp_path.glob("*.started"))) <= window + consumed
+    assert len(list(tmp_path.glob("*.started"))) == 30
+
+def test_stuck_and_dead_workers_are_replaced_and_their_files_reported():
+    context = get_context()
+    starts = context.SimpleQueue()
+    names = ["stuck", "crashed", "a", "b", "c"]
+    with context.Pool(2, initializer=_init_worker, initargs=(None, starts)) as pool:
+        results = list(_windowed(pool, stuck_or_crashed, map(Path, names), window=4, starts=starts, deadline=1.0,
+            lost=lambda path, reason, seconds: (path.name, reason)))
+
+    assert sorted(result for result in results if isinstance(result, str)) == ["a", "b", "c"]
+    lost = dict(result for result in results if isinstance(result, tuple))
+    assert lost["crashed"] == "worker process died"
+    assert lost["stuck"].startswith("timed out")
+
+def test_worker_pids_the_pool_no_longer_has_are_not_killed():
+    # a pid that outlived its worker may be any other process, here this one
+    running = {0: (os.getpid(), time.time() - 60)}
+    with get_context().Pool(1) as pool:
+        n, reason = _overdue(pool, {0: "task"}, running, get_context().SimpleQueue(), 1.0, lambda task, reason, seconds: reason)
+    assert n == 0 and reason == "worker process died"
+
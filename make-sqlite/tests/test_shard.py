@@ -0,0 +1,60 @@
+import argparse
+import re
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from src.merge_shards import MERGE_TABLES, merge_shard
+from src.shard import Shard, copy_schema
+
+MODELS = Path(__file__).parent.parent.joinpath("dbt", "models")
+MD5S = [f"{i:03x}" + "0" * 29 for i in range(4096)]
+
+def create_tables(path: Path):
+    """The tables dbt run would create, without dbt."""
+    db = sqlite3.connect(path)
+    for table in MERGE_TABLES:
+        sql = MODELS.joinpath(table + ".sql").read_text()
+        sql = sql[sql.index("create table"):].replace("{{ this }}", table)
+        db.execute(re.sub(r'\{\{ ref\("(\w+)"\)\.name \}\}', r"\1", sql))
+    db.commit()
+    db.close()
+
+def test_parse():
+    assert Shard.parse("2/4") == Shard(2, 4)
+    for spec in ("4/4", "-1/4", "1", "a/b"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            Shard.parse(spec)
+
+def test_every_md5_and_sid_in_exactly_one_shard():
+    shards = [Shard(i, 3) for i in range(3)]
+    sids = [f"{i:022d}" for i in range(300)]
+    assert all(sum(shard.has_md5(md5) for shard in shards) == 1 for md5 in MD5S)
+    assert all(sum(shard.has_sid(sid) for shard in shards) == 1 for sid in sids)
+    # whole MMD directories go to one shard, and the split is even
+    assert {shards[0].has_md5(md5[:3] + "f" * 29) for md5 in MD5S if shards[0].has_md5(md5)} == {True}
+    assert sum(map(shards[0].has_md5, MD5S)) in (1365, 1366)
+
+def test_shard_path():
+    assert Shard().path(Path("dbt/data.sqlite3")) == Path("dbt/data.sqlite3")
+    assert Shard(1, 4).path(Path("dbt/data.sqlite3")) == Path("dbt/data.shard-1-of-4.sqlite3")
+
+def test_merge_deduplicates_shared_rows(tmp_path):
+    create_tables(tmp_path / "template.sqlite3")
+    shards = [tmp_path / "shard-0.sqlite3", tmp_path / "shard-1.sqlite3"]
+    for i, path in enumerate(shards):
+        copy_schema(tmp_path / "template.sqlite3", path)
+        db = sqlite3.connect(path)
+        db.execute("insert into artists values ('artist', 'shared')")
+        db.execute("insert into midi_spotify_map values (?, 'sid', 0.5)", (MD5S[i],))
+        db.execute("insert into midi_spotify_map values ('shared', 'sid', 0.5)")
+        db.commit()
+        db.close()
+
+    copy_schema(tmp_path / "template.sqlite3", tmp_path / "out.sqlite3")
+    db = sqlite3.connect(tmp_path / "out.sqlite3")
+    assert merge_shard(db, shards[0])["midi_spotify_map"] == 2
+    added = merge_shard(db, shards[1])
+    assert added["artists"] == 0 and added["midi_spotify_map"] == 1
+    assert db.execute("select count(*) from midi_spotify_map").fetchone()[0] == 3
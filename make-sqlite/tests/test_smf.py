@@ -0,0 +1,103 @@
+from pathlib import Path
+
+import mido
+import pytest
+from miditoolkit import MidiFile
+
+from src.synpy3 import WNBD, readmidi
+from src.synpy3.music_objects import NoteSequence, note_sequence_to_velocity_sequence
+from src.synpy3.smf import SMFError, read_smf
+from src.synpy3.syncopation import calculate_syncopation
+
+TEST_MIDIS = sorted(Path(__file__).parent.parent.joinpath("src", "synpy3", "test_midis", "wnbd").glob("*.mid"))
+
+def write_midi(path: Path):
+    """Two tracks with running status, drums, program changes, overlapping same-pitch notes and meter changes."""
+    midi = mido.MidiFile(ticks_per_beat=96)
+    meta = mido.MidiTrack([
+        mido.MetaMessage("set_tempo", tempo=500000),
+        mido.MetaMessage("time_signature", numerator=4, denominator=4),
+        mido.MetaMessage("set_tempo", tempo=400000, time=384),
+        mido.MetaMessage("time_signature", numerator=3, denominator=4, time=384),
+    ])
+    drums = mido.MidiTrack([
+        mido.Message("sysex", data=[1, 2, 3]),
+        mido.Message("note_on", channel=9, note=36, velocity=100),
+        mido.Message("note_on", channel=9, note=36, velocity=90, time=24), # overlaps the first
+        mido.Message("note_on", channel=9, note=36, velocity=0, time=24),
+        mido.Message("note_off", channel=9, note=36, time=24),
+        mido.Message("control_change", channel=9, control=7, value=100, time=100),
+        mido.Message("note_on", channel=9, note=38, velocity=80, time=500),
+        mido.Message("note_on", channel=9, note=38, velocity=0, time=48),
+    ])
+    piano = mido.MidiTrack([mido.Message("program_change", channel=0, program=5)])
+    for i in range(16):
+        piano.append(mido.Message("note_on", channel=0, note=60 + i % 3, velocity=10 + i, time=0 if i % 4 else 48))
+        piano.append(mido.Message("note_on", channel=0, note=60 + i % 3, velocity=0, time=96))
+        if i == 8:
+            piano.append(mido.Message("program_change", channel=0, program=7))
+    midi.tracks += [meta, drums, piano]
+    midi.save(path)
+
+def test_reads_the_same_as_miditoolkit(tmp_path):
+    write_midi(tmp_path / "test.mid")
+    for path in [tmp_path / "test.mid", *TEST_MIDIS]:
+        midi_file, smf = MidiFile(path), read_smf(path.read_bytes())
+        assert smf.ticks_per_beat == midi_file.ticks_per_beat
+        assert [(i.program, i.is_drum) for i in smf.instruments] == [(i.program, i.is_drum) for i in midi_file.instruments]
+        expected = [(n.start, n.end, n.pitch, n.velocity, i) for i, inst in enumerate(midi_file.instruments) for n in inst.notes]
+        assert sorted(zip(*(column.tolist() for column in smf.notes))) == sorted(expected)
+        assert [(t.tempo, t.time) for t in smf.tempo_changes] == [(t.tempo, t.time) for t in midi_file.tempo_changes]
+        assert [(t.numerator, t.denominator, t.time) for t in smf.time_signature_changes] == \
+            [(t.numerator, t.denominator, t.time) for t in midi_file.time_signature_changes]
+
+        # and segments and scores the same
+        assert calculate_syncopation(WNBD, readmidi.get_bars_from_midi(smf)) == \
+            calculate_syncopation(WNBD, readmidi.get_bars_from_midi(midi_file))
+
+def test_rejects_broken_files(tmp_path):
+    write_midi(tmp_path / "test.mid")
+    data = (tmp_path / "test.mid").read_bytes()
+    with pytest.raises(SMFError):
+        read_smf(b"not a midi file")
+    with pytest.raises(SMFError):
+        read_smf(data[:-10])
+    assert len(read_smf(memoryview(data)).notes) == len(read_smf(data).notes)
+
+def test_every_note_lands_in_its_bar(tmp_path):
+    write_midi(tmp_path / "test.mid")
+    smf = read_smf(tmp_path / "test.mid")
+    bars = readmidi.get_bars_from_midi(smf)
+
+    assert sum(len(bar.get_note_sequence()) for bar in bars) == len(smf.notes)
+    assert all(0 <= note.start < bar.get_bar_ticks() for bar in bars for note in bar.get_note_sequence())
+    # bars run up to the one with the last note, and no further
+    assert len(bars[-1].get_note_sequence()) > 0
+    assert sum(bar.get_bar_ticks() for bar in bars[:-1]) <= smf.notes.start.max()
+
+def test_segmenting_leaves_the_notes_alone(tmp_path):
+    write_midi(tmp_path / "test.mid")
+    smf = read_smf(tmp_path / "test.mid")
+    table = [column.copy() for column in smf.sorted_notes]
+    first, again = readmidi.get_bars_from_midi(smf), readmidi.get_bars_from_midi(smf)
+
+    assert all((column == copy).all() for column, copy in zip(smf.sorted_notes, table))
+    assert [list(bar.get_note_sequence()) for bar in first] == [list(bar.get_note_sequence()) for bar in again]
+    # durations survive the shift to bar-relative starts
+    assert sorted(note.duration for bar in first for note in bar.get_note_sequence()) == sorted((smf.notes.end - smf.notes.start).tolist())
+
+    for bar in first:
+        notes = NoteSequence()
+        notes.extend(bar.get_note_sequence())
+        assert bar.get_velocity_sequence() == note_sequence_to_velocity_sequence(notes, bar.get_bar_ticks())
+
+def test_bar_notes_read_like_a_list(tmp_path):
+    write_midi(tmp_path / "test.mid")
+    bars = readmidi.get_bars_from_midi(read_smf(tmp_path / "test.mid"))
+    first, second = bars[0].get_note_sequence(), bars[1].get_note_sequence()
+
+    assert first == list(first) and first != second
+    assert first[1:3] == list(first)[1:3] and first[-1] == list(first)[-1]
+    assert repr(first).startswith("NoteView([TableNote(")
+    with pytest.raises(ValueError):
+        first[::2]
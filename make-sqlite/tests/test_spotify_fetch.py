@@ -0,0 +1,163 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import models
+from src.cache import TrackCache
+from src.features import FeatureStore
+from src.models import LinkIndex, SpotifyAPI, SpotifyTrack
+from src.spotify_fetch import SpotifyFetcher, TokenBucket
+
+SIDS = [f"{i:022d}" for i in range(120)]
+
+def track(sid: str) -> dict:
+    return {
+        "id": sid,
+        "name": f"song {sid}",
+        "duration_ms": 1000,
+        "popularity": 50,
+        "album": {"id": "album", "name": "album", "release_date": "1999-01-01"},
+        "artists": [{"id": "artist", "name": "artist"}],
+    }
+
+class StubSpotify(BaseHTTPRequestHandler):
+    """Token and tracks endpoints. The first tracks request is rate limited unless reset otherwise."""
+    protocol_version = "HTTP/1.1" # keep-alive, like the real API
+    lock = threading.Lock()
+
+    @classmethod
+    def reset(cls, expires_in: int = 3600, rate_limit_first: bool = True):
+        cls.expires_in = expires_in
+        cls.rate_limit_first = rate_limit_first
+        cls.requests = 0
+        cls.in_flight = 0
+        cls.max_in_flight = 0
+        cls.tokens_issued = 0
+        cls.connections = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        with self.lock:
+            StubSpotify.tokens_issued += 1
+            StubSpotify.connections.add(self.client_address)
+        self.reply(200, {"access_token": "stub-token", "expires_in": StubSpotify.expires_in})
+
+    def do_GET(self):
+        assert self.headers["Authorization"] == "Bearer stub-token"
+        with self.lock:
+            StubSpotify.requests += 1
+            first = StubSpotify.rate_limit_first and StubSpotify.requests == 1
+            StubSpotify.in_flight += 1
+            StubSpotify.max_in_flight = max(StubSpotify.max_in_flight, StubSpotify.in_flight)
+            StubSpotify.connections.add(self.client_address)
+        try:
+            if first:
+                self.reply(429, {}, headers={"retry-after": "1"})
+                return
+            time.sleep(0.1)
+            ids = parse_qs(urlparse(self.path).query)["ids"][0].split(",")
+            # the last id of every batch is unknown to the API
+            self.reply(200, {"tracks": [track(sid) for sid in ids[:-1]] + [None]})
+        finally:
+            with self.lock:
+                StubSpotify.in_flight -= 1
+
+    def reply(self, status: int, body: dict, headers: dict = {}):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def stub_url(monkeypatch):
+    monkeypatch.setenv("SPOTIFY_CLIENT_ID", "id")
+    monkeypatch.setenv("SPOTIFY_CLIENT_SECRET", "secret")
+    StubSpotify.reset()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubSpotify)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def test_fetch_concurrent_batches(stub_url):
+    api = SpotifyAPI(api_url=stub_url + "/v1", auth_url=stub_url + "/api/token")
+    links = LinkIndex(pd.DataFrame({"md5": ["a" * 32] * len(SIDS), "sid": SIDS, "score": 0.5}))
+    features = FeatureStore(np.array(SIDS[:1]), np.zeros((1, 6), dtype=np.float32))
+    fetcher = SpotifyFetcher(api, concurrency=3, limiter=TokenBucket(rate=100, capacity=3))
+
+    batches = [SIDS[i:i + 50] for i in range(0, len(SIDS), 50)]
+    results = dict((tuple(ids), tracks) for ids, tracks in fetcher.tracks(batches, links, features))
+
+    assert set(results) == {tuple(ids) for ids in batches}
+    for ids, tracks in results.items():
+        assert [t.id for t in tracks] == list(ids[:-1])
+        assert all(t.year_first_released == 1999 for t in tracks)
+    assert results[tuple(batches[0])][0].has_features
+    # one 429 and three batches, all sharing one token and overlapping in flight
+    assert StubSpotify.requests == len(batches) + 1
+    assert StubSpotify.tokens_issued == 1
+    assert StubSpotify.max_in_flight > 1
+
+def test_warm_cache_skips_requests(stub_url, tmp_path, monkeypatch):
+    api = SpotifyAPI(api_url=stub_url + "/v1", auth_url=stub_url + "/api/token")
+    monkeypatch.setattr(models, "shared_api", lambda: api)
+    links = LinkIndex(pd.DataFrame({"md5": ["a" * 32] * len(SIDS), "sid": SIDS, "score": 0.5}))
+    features = FeatureStore(np.array(SIDS[:1]), np.zeros((1, 6), dtype=np.float32))
+    StubSpotify.reset(rate_limit_first=False)
+
+    with TrackCache(tmp_path / "tracks.sqlite3") as cache:
+        cold = SpotifyTrack.from_ids(SIDS[:50], links, features, cache=cache)
+    assert StubSpotify.requests == 1
+
+    fetcher = SpotifyFetcher(api, concurrency=2)
+    batches = [SIDS[i:i + 50] for i in range(0, len(SIDS), 50)]
+    with TrackCache(tmp_path / "tracks.sqlite3") as cache:
+        results = list(fetcher.tracks(batches, links, features, cache=cache))
+        # the 50 cached ids (one of them unknown to the API) need no request, the other 70 two
+        assert StubSpotify.requests == 3
+        assert sorted(id for ids, _ in results for id in ids) == sorted(SIDS)
+        assert sorted(t.id for _, tracks in results for t in tracks)[:49] == [t.id for t in cold]
+
+        offline = SpotifyTrack.from_ids(SIDS[50:100], links, features, cache=cache)
+        assert StubSpotify.requests == 3
+        assert len(offline) == 49
+
+def test_token_refreshed_before_expiry_over_one_connection(stub_url, monkeypatch):
+    monkeypatch.setattr(models, "TOKEN_REFRESH_MARGIN", 0.0)
+    StubSpotify.reset(expires_in=1, rate_limit_first=False)
+    api = SpotifyAPI(api_url=stub_url + "/v1", auth_url=stub_url + "/api/token")
+
+    api.get_tracks(SIDS[:50])
+    api.get_tracks(SIDS[50:100])
+    assert StubSpotify.tokens_issued == 1
+    time.sleep(1.1)
+    api.get_tracks(SIDS[100:])
+    assert StubSpotify.tokens_issued == 2
+    # token and tracks requests all went over one kept-alive connection
+    assert StubSpotify.requests == 3
+    assert len(StubSpotify.connections) == 1
+
+def test_fetcher_runs_again_on_a_new_loop(stub_url):
+    StubSpotify.reset(rate_limit_first=False)
+    api = SpotifyAPI(api_url=stub_url + "/v1", auth_url=stub_url + "/api/token")
+    links = LinkIndex(pd.DataFrame({"md5": ["a" * 32] * len(SIDS), "sid": SIDS, "score": 0.5}))
+    features = FeatureStore(np.array(SIDS[:1]), np.zeros((1, 6), dtype=np.float32))
+    # one token at a time, so the batches queue on the limiter's lock every time
+    fetcher = SpotifyFetcher(api, concurrency=3, limiter=TokenBucket(rate=50, capacity=1))
+
+    batches = [SIDS[i:i + 20] for i in range(0, len(SIDS), 20)]
+    for _ in range(2): # tracks() runs a new event loop per call
+        assert len(list(fetcher.tracks(batches, links, features))) == len(batches)
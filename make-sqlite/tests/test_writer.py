@@ -0,0 +1,43 @@
+import sqlite3
+
+import pytest
+
+from src.writer import BatchWriter
+
+def make_db(path) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.execute("create table artists (artist_id varchar primary key, title varchar not null)")
+    return db
+
+def count(db: sqlite3.Connection) -> int:
+    return db.execute("select count(*) from artists").fetchone()[0]
+
+def test_batches_and_commits(tmp_path):
+    db = make_db(tmp_path / "data.sqlite3")
+    with BatchWriter(db, batch_size=3, commit_every=4) as writer:
+        for i in range(5):
+            writer.add("artists", ["artist_id", "title"], [(str(i), f"artist {i}")])
+        # one commit after the fourth row, the fifth is still buffered
+        reader = sqlite3.connect(tmp_path / "data.sqlite3")
+        assert count(reader) == 4
+        reader.close()
+        assert db.execute("pragma journal_mode").fetchone()[0] == "wal"
+    assert count(db) == 5
+    assert writer.rows_written == 5
+    assert db.execute("pragma journal_mode").fetchone()[0] == "delete"
+
+def test_ignore_duplicates(tmp_path):
+    db = make_db(tmp_path / "data.sqlite3")
+    with BatchWriter(db) as writer:
+        rows = [("a", "first"), ("a", "again")]
+        writer.add("artists", ["artist_id", "title"], rows, integrity_handler="ignore")
+    assert db.execute("select title from artists").fetchall() == [("first",)]
+
+def test_rollback_on_error(tmp_path):
+    db = make_db(tmp_path / "data.sqlite3")
+    with pytest.raises(KeyboardInterrupt):
+        with BatchWriter(db, commit_every=2) as writer:
+            for i in range(3):
+                writer.add("artists", ["artist_id", "title"], [(str(i), "x")])
+            raise KeyboardInterrupt
+    assert count(db) == 2